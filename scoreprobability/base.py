@@ -6,8 +6,10 @@
 @Desc      : basic module of entire project
 """
 
+import itertools
 import typing
 
+import numpy as np
 import pandas as pd
 import yaml
 from pymongo import MongoClient
@@ -40,6 +42,40 @@ SERVER_FILE_PATH = "/home/pauleta/pauleta-gauss/ScoreProbability/" \
                    "scoreprobability/server.yaml"
 
 
+class TeamIndex:
+    def __init__(self, teams: typing.Iterable):
+        """
+        dense integer index 0 .. n - 1 of the teams of a league
+        :param teams: team names or team ids, the codes follow sorted order
+        """
+        self.teams = sorted(set(teams))
+        self._code = dict(zip(self.teams, range(len(self.teams))))
+
+    @classmethod
+    def from_data(cls, data: pd.DataFrame) -> 'TeamIndex':
+        """index of the teams which have played, at home or away"""
+        return cls(np.concatenate([data.HomeTeam.unique(),
+                                   data.AwayTeam.unique()]))
+
+    def __len__(self) -> int:
+        return len(self.teams)
+
+    def __contains__(self, team) -> bool:
+        return team in self._code
+
+    def code(self, team) -> int:
+        """integer code of a single team"""
+        return self._code[team]
+
+    def codes(self, teams: typing.Iterable) -> np.ndarray:
+        """integer codes of a column of teams"""
+        codes = pd.Categorical(teams, categories=self.teams).codes
+        if (codes < 0).any():
+            unknown = set(pd.Series(list(teams))[codes < 0])
+            raise KeyError("unknown teams: {0}".format(unknown))
+        return codes.astype(np.intp)
+
+
 def connect_mongodb() -> MongoClient:
     """connect mongodb"""
     config = yaml.load(open(SERVER_FILE_PATH, encoding="utf-8"))
@@ -94,58 +130,156 @@ def team_id_en_name_by_league_id(
     return result_dct
 
 
-def get_played_data(db_client: MongoClient,
-                    qtw_league_id: int) -> pd.DataFrame:
-    """get have finished match information by qtw_league_id"""
+# documents converted per cursor batch
+CURSOR_BATCH_SIZE = 1000
+
+PLAYED_COLUMNS = ['Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'status',
+                  'gameweek']
 
-    Date_lst, HomeTeam_lst, AwayTeam_lst = [], [], []
-    FTHG_lst, FTAG_lst, status_lst, gameweek_lst = [], [], [], []
+FIXTURE_COLUMNS = ['qtw_match_id', 'match_time', 'home_id', 'away_id']
+
+
+def cursor_columns(cursor: typing.Iterable[dict],
+                   fields: typing.Dict[str, typing.Any],
+                   batch_size: int = CURSOR_BATCH_SIZE
+                   ) -> typing.Dict[str, np.ndarray]:
+    """
+    read a cursor batch by batch into one typed array per field
+    :param cursor: pymongo cursor or any iterable of documents
+    :param fields: {field: numpy dtype}, object --> values kept as they are
+    :param batch_size: documents converted at a time
+    :return: {field: array}
+    """
+    if hasattr(cursor, "batch_size"):
+        cursor = cursor.batch_size(batch_size)
+    cursor = iter(cursor)
+
+    chunks = {field: [] for field in fields}
+    batch = list(itertools.islice(cursor, batch_size))
+    while batch:
+        for field, dtype in fields.items():
+            values = (doc[field] for doc in batch)
+            if dtype is object:
+                chunk = np.empty(len(batch), dtype=object)
+                chunk[:] = list(values)
+            else:
+                chunk = np.fromiter(values, dtype, len(batch))
+            chunks[field].append(chunk)
+        batch = list(itertools.islice(cursor, batch_size))
+
+    return {field: np.concatenate(chunks[field]) if chunks[field]
+            else np.empty(0, dtype=dtype) for field, dtype in fields.items()}
+
+
+def team_names(team_ids: np.ndarray,
+               team_id_to_name: typing.Dict[int, str]) -> np.ndarray:
+    """names of a column of team ids, an unknown id raises KeyError"""
+    unique_ids, inverse = np.unique(team_ids, return_inverse=True)
+    names = np.array([team_id_to_name[int(team_id)]
+                      for team_id in unique_ids], dtype=object)
+    return names[inverse]
+
+
+def latest_match_time(db_client: MongoClient,
+                      qtw_league_id: int) -> typing.Optional[str]:
+    """match_time of the latest played match of the league, None --> none"""
+    result = db_client["xscore"]["match_info"].find_one(
+        filter={"qtw_league_id": int(qtw_league_id), "status": 2},
+        projection={"_id": 0, "match_time": 1},
+        sort=[("match_time", -1)])
+    return None if result is None else result["match_time"]
+
+
+def get_played_data(db_client: MongoClient, qtw_league_id: int,
+                    team_ids: bool = True, since: str = None,
+                    last_days: float = None) -> pd.DataFrame:
+    """
+    get have finished match information by qtw_league_id
+    :param team_ids: HomeTeam, AwayTeam as qtw team ids, the model is fitted
+        on ids and the names are only looked up for display, False --> en
+        names
+    :param since: only the matches from this match_time on, such as
+        "2017-08-01 00:00:00", None --> every season
+    :param last_days: only the matches of the last days before the latest
+        played match of the league, the same window whenever it is read
+    :return: data frame --> Date (datetime), HomeTeam, AwayTeam, FTHG, FTAG,
+        status, gameweek
+    """
 
     match_tb = db_client["xscore"]["match_info"]
-    team_id_to_en_name = team_id_en_name_by_league_id(
-        db_client=db_client, league_id=qtw_league_id)
+
+    if last_days is not None and np.isfinite(last_days):
+        latest = latest_match_time(db_client, qtw_league_id)
+        if latest is not None:
+            start = pd.Timestamp(latest) - pd.Timedelta(days=float(last_days))
+            since = max(since or "", start.strftime("%Y-%m-%d %H:%M:%S"))
+
+    query = {"qtw_league_id": int(qtw_league_id), "status": 2}
+    if since:
+        query["match_time"] = {"$gte": since}
 
     result = match_tb.find(
-        filter={"qtw_league_id": int(qtw_league_id), "status": 2},
+        filter=query,
         projection={
-            "home_id": 1, "away_id": 1, "match_time": 1, "home_score": 1,
-            "away_score": 1, "status": 1, "game_week": 1
+            "_id": 0, "home_id": 1, "away_id": 1, "match_time": 1,
+            "home_score": 1, "away_score": 1, "status": 1, "game_week": 1
         }
     )
 
-    result_lst = list(result)
+    columns = cursor_columns(result, {
+        "match_time": object, "home_id": np.int64, "away_id": np.int64,
+        "home_score": np.int64, "away_score": np.int64, "status": np.int64,
+        "game_week": np.int64
+    })
 
-    for result_data in result_lst:
-        Date_lst.append(result_data["match_time"])
-        HomeTeam_lst.append(
-            team_id_to_en_name[result_data["home_id"]])
-        AwayTeam_lst.append(
-            team_id_to_en_name[result_data["away_id"]])
-        FTHG_lst.append(int(result_data["home_score"]))
-        FTAG_lst.append(int(result_data["away_score"]))
-        status_lst.append(int(result_data["status"]))
-        gameweek_lst.append(int(result_data["game_week"]))
+    home_team, away_team = columns["home_id"], columns["away_id"]
+    if not team_ids:
+        team_id_to_en_name = team_id_en_name_by_league_id(
+            db_client=db_client, league_id=qtw_league_id)
+        home_team = team_names(home_team, team_id_to_en_name)
+        away_team = team_names(away_team, team_id_to_en_name)
 
     df = pd.DataFrame(
         {
-            'Date': Date_lst, 'HomeTeam': HomeTeam_lst,
-            'AwayTeam': AwayTeam_lst, 'FTHG': FTHG_lst, 'FTAG': FTAG_lst,
-            'status': status_lst, 'gameweek': gameweek_lst
+            'Date': pd.to_datetime(columns["match_time"]),
+            'HomeTeam': home_team, 'AwayTeam': away_team,
+            'FTHG': columns["home_score"], 'FTAG': columns["away_score"],
+            'status': columns["status"], 'gameweek': columns["game_week"]
         },
-        columns=[
-            'Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'status',
-            'gameweek'
-        ])
+        columns=PLAYED_COLUMNS)
 
     return df
 
 
+def join_played_data(frames: typing.Dict[typing.Any, pd.DataFrame]
+                     ) -> pd.DataFrame:
+    """
+    union of the played data of several leagues, the same whatever the
+    order of the leagues
+    :param frames: {league: played data}, league --> qtw_league_id or csv
+    :return: data frame --> Date (datetime), HomeTeam, AwayTeam, FTHG, FTAG,
+        League (str), sorted by Date, League, HomeTeam
+    """
+    parts = []
+    for league, data in frames.items():
+        part = pd.DataFrame({
+            'Date': pd.to_datetime(data['Date']).values,
+            'HomeTeam': np.asarray(data['HomeTeam']),
+            'AwayTeam': np.asarray(data['AwayTeam']),
+            'FTHG': data['FTHG'].values, 'FTAG': data['FTAG'].values,
+        }, columns=['Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG'])
+        part['League'] = str(league)
+        parts.append(part)
+
+    data = pd.concat(parts, ignore_index=True)
+    data = data.sort_values(['Date', 'League', 'HomeTeam'], kind='mergesort')
+    return data.reset_index(drop=True)
+
+
 def get_fixture_data(db_client: MongoClient, qtw_league_id: int,
                      start_time: str, end_time: str) -> pd.DataFrame:
     """get fixture match information by qtw_league_id"""
 
-    qtw_match_id_lst, match_time_lst, home_id_lst, away_id_lst = [], [], [], []
-
     match_tb = db_client["xscore"]["match_info"]
 
     result = match_tb.find(
@@ -155,33 +289,17 @@ def get_fixture_data(db_client: MongoClient, qtw_league_id: int,
             "status": {"$in": [1, 3]}
         },
         projection={
-            "qtw_match_id": 1, "home_id": 1, "away_id": 1, "match_time": 1
+            "_id": 0, "qtw_match_id": 1, "home_id": 1, "away_id": 1,
+            "match_time": 1
         }
     )
 
-    columns_lst = ['qtw_match_id', 'match_time', 'home_id', 'away_id']
-
-    if result is not None:
-
-        result_lst = list(result)
-        for result_data in result_lst:
-            qtw_match_id_lst.append(int(result_data["qtw_match_id"]))
-            match_time_lst.append(result_data["match_time"])
-            home_id_lst.append(int(result_data["home_id"]))
-            away_id_lst.append(int(result_data["away_id"]))
-
-        df = pd.DataFrame(
-            {
-                'qtw_match_id': qtw_match_id_lst, 'match_time': match_time_lst,
-                'home_id': home_id_lst, 'away_id': away_id_lst
-            },
-            columns=columns_lst)
-
-        return df
-
-    else:
+    columns = cursor_columns(result, {
+        "qtw_match_id": np.int64, "match_time": object,
+        "home_id": np.int64, "away_id": np.int64
+    })
 
-        return pd.DataFrame(columns=columns_lst)
+    return pd.DataFrame(columns, columns=FIXTURE_COLUMNS)
 
 
 def get_time(start_time, end_time):
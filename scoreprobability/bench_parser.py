@@ -0,0 +1,113 @@
+"""
+@Project   : ScoreProbability
+@Module    : bench_parser.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 2:50 PM
+@Desc      : benchmark the season payload tokenizer against regex + eval
+"""
+
+import re
+import time
+import tracemalloc
+
+import fire
+
+from qtw_parser import iter_rounds, parse_teams
+
+
+def legacy_parse(page_text: str):
+    """the former regex + eval parsing of crawl.py"""
+    pattern = re.compile('jh.* = .*]')
+    match_lst = re.findall(pattern, page_text)
+
+    week_match_lst = []
+    game_week = 0
+    for match_str in match_lst:
+        game_week += 1
+        match_info_str = match_str.replace(",,,", ",'','',")
+        match_info_lst = eval(str(match_info_str).split(" = ")[1])
+        for match_information in match_info_lst:
+            week_match_lst.append((game_week, match_information))
+
+    match_group = re.search(re.compile("arrTeam = .*]"), page_text).group()
+    team_information_lst = eval(str(match_group).split(" = ")[1])
+
+    return week_match_lst, team_information_lst
+
+
+def tokenizer_parse(page_text: str):
+    """parsing of crawl.py with qtw_parser"""
+    week_match_lst = [
+        (game_week, match_information)
+        for game_week, _, match_info_lst in iter_rounds(page_text)
+        for match_information in match_info_lst]
+
+    return week_match_lst, parse_teams(page_text)
+
+
+def synthetic_season(rounds: int = 38, per_round: int = 10) -> str:
+    """season payload with the layout of the qtw js"""
+    lines = ["var arrTeam = [{0}];".format(",".join(
+        "[{0},'队{0}','隊{0}','Team {0}','',0]".format(team_id)
+        for team_id in range(2 * per_round)))]
+    for game_week in range(1, rounds + 1):
+        rows = []
+        for i in range(per_round):
+            match_id = 1500000 + game_week * 100 + i
+            rows.append(
+                "[{0},36,-1,'2018-08-11 03:00',{1},{2},'2-1','1-0','8',"
+                "'15',1.25,0.5,'2.5/3','1',1,1,1,1,0,,,]".format(
+                    match_id, i, i + per_round))
+        lines.append('jh["R_{0}"] = [{1}];'.format(
+            game_week, ",".join(rows)))
+    return "\n".join(lines)
+
+
+def measure(parse, page_text: str, repeat: int):
+    """best seconds and peak traced bytes of parse(page_text)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(page_text)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = parse(page_text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak, result
+
+
+def main(*paths, repeat: int = 5):
+    """
+    compare both parsers on saved season js files
+    :param paths: saved season payload files, none --> a synthetic season
+    :param repeat: timing repeats, the best one is reported
+    """
+    sources = [(path, open(path, encoding="utf-8").read())
+               for path in paths] or [("synthetic", synthetic_season())]
+
+    for name, page_text in sources:
+        legacy_time, legacy_peak, legacy = measure(
+            legacy_parse, page_text, repeat)
+        new_time, new_peak, new = measure(
+            tokenizer_parse, page_text, repeat)
+
+        legacy_matches = [(week, list(row[:7])) for week, row in legacy[0]]
+        new_matches = [(week, list(row)) for week, row in new[0]]
+        same = legacy_matches == new_matches and \
+            [list(row[:4]) for row in legacy[1]] == \
+            [list(row) for row in new[1]]
+
+        print("{0}: {1} matches, same result = {2}".format(
+            name, len(new_matches), same))
+        print("    regex + eval: {0:.2f} ms, peak {1:.1f} KB".format(
+            legacy_time * 1000, legacy_peak / 1024))
+        print("    tokenizer   : {0:.2f} ms, peak {1:.1f} KB".format(
+            new_time * 1000, new_peak / 1024))
+
+
+if __name__ == "__main__":
+    # python3 bench_parser.py output/s36.js output/s8.js
+    fire.Fire(main)
@@ -0,0 +1,82 @@
+"""
+@Project   : ScoreProbability
+@Module    : compare_engines.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 11:40 AM
+@Desc      : compare the mle engine params with the mcmc posterior means
+"""
+
+import fire
+import loguru
+import numpy as np
+import pandas as pd
+
+from base import SUPPORT_LEAGUE_NAME_ID, connect_mongodb
+from likelihood import DEFAULT_HALF_LIFE, fit_mle
+from score_predict import ScoreProbabilityModel
+
+logger = loguru.logger
+
+
+def compare_params(data: pd.DataFrame,
+                   half_life: float = DEFAULT_HALF_LIFE) -> pd.DataFrame:
+    """
+    fit the same played data with both engines
+    :param data: played data --> Date, HomeTeam, AwayTeam, FTHG, FTAG
+    :param half_life: time weighting half life of both fits in days
+    :return: data frame of params of both engines and their difference
+    """
+    mle_teams, mle_traces = fit_mle(data, half_life)
+    mcmc_teams, mcmc_traces = ScoreProbabilityModel.sample_posterior(
+        data, half_life=half_life)
+
+    rows = []
+    for name in ['alpha', 'beta']:
+        mle_values = mle_traces[name][0]
+        mcmc_values = mcmc_traces[name].mean(axis=0)
+        for team, mle_value, mcmc_value in zip(
+                mcmc_teams, mle_values, mcmc_values):
+            rows.append((name, team, mcmc_value, mle_value))
+    rows.append(('lambda_value', '', mcmc_traces['lambda_value'].mean(),
+                 mle_traces['lambda_value'][0]))
+
+    result = pd.DataFrame(rows, columns=['param', 'team', 'mcmc', 'mle'])
+    result['diff'] = result['mle'] - result['mcmc']
+
+    return result
+
+
+def main(league_name: str = None, csv: str = None,
+         half_life: float = DEFAULT_HALF_LIFE, tolerance: float = 0.1):
+    """
+    compare the engines on a league or a csv of played data
+    :param league_name: "dj", "yc", ... data comes from mongodb
+    :param csv: played data csv, used when league_name is None
+    :param half_life: time weighting half life of both fits in days
+    :param tolerance: max accepted absolute difference of a param
+    """
+    if league_name is not None:
+        db_client = connect_mongodb()
+        model = ScoreProbabilityModel(
+            db_client, 'database', SUPPORT_LEAGUE_NAME_ID[league_name])
+        model.get_data()
+        db_client.close()
+    else:
+        model = ScoreProbabilityModel(None, 'csv', csv=csv)
+        model.get_data()
+
+    result = compare_params(model.data, float(half_life))
+    print(result.to_string())
+
+    max_diff = np.abs(result['diff']).max()
+    print("max abs diff = {0:.4f}, tolerance = {1}".format(
+        max_diff, tolerance))
+    if max_diff > tolerance:
+        logger.error("mle params differ from the mcmc posterior means")
+    else:
+        logger.info("mle params agree with the mcmc posterior means")
+
+
+if __name__ == "__main__":
+    # python3 compare_engines.py --league_name dj
+    fire.Fire(main)
@@ -7,25 +7,48 @@
 """
 
 import datetime
-import re
+import json
+import os
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import loguru
 import requests
+import requests.adapters
 import yaml
 from bs4 import BeautifulSoup
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.collection import Collection
 
 from base import SUPPORT_LEAGUE_NAME_ID, SERVER_FILE_PATH
+from transport import get_transport
+from qtw_parser import MatchRecord, TeamRecord, iter_rounds, parse_teams
+
+# qtw match status which can not change any more: -1 --> played, a
+# cancelled or abandoned match is stored as a fixture and may still be
+# rescheduled, so its round stays open
+QTW_FINAL_STATUS = (-1,)
 
 # qtw company bet
 QTW_COMPANY_BET = [8, 23, 24, 31]
 
+# concurrent odds fetching
+ODDS_MAX_WORKERS = 8
+ODDS_TIMEOUT = 10
+ODDS_HOST_INTERVAL = 0.05
+
 YP_URL = "http://vip.win007.com/changeDetail/handicap.aspx?" \
          "id={qtw_match_id}&companyID={company_id}&l=0"
 
 DXQ_URL = "http://vip.win007.com/changeDetail/overunder.aspx?" \
           "id={qtw_match_id}&companyID={company_id}&l=0"
 
+# local copy of the season js pages, revalidated by conditional get
+SEASON_CACHE_DIR = "output/season/"
+
 LEAGUE_URL = "http://zq.win007.com/cn/SubLeague/{league_id}.html"
 
 SEASON_URL = "http://zq.win007.com/jsData/matchResult/2018-2019/" \
@@ -57,172 +80,358 @@ SPECIAL_SEASON_URL = {
 logger = loguru.logger
 
 
-def get_latest_odds_by_qtw_match_id(qtw_match_id: int, odd_type: str):
+class HostRateLimiter:
+    def __init__(self, min_interval: float = ODDS_HOST_INTERVAL):
+        """
+        thread safe per host rate limit
+        :param min_interval: min seconds between two requests to a host
+        """
+        self._min_interval = min_interval
+        self._next_time = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        """block until a request to the host of url is allowed"""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            request_time = max(now, self._next_time.get(host, now))
+            self._next_time[host] = request_time + self._min_interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+def pooled_session(pool_size: int = ODDS_MAX_WORKERS) -> requests.Session:
+    """keep-alive session with a connection pool per host"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_latest_odd_by_company_id(match_id: int, company_id: int, odd: str,
+                                 session: requests.Session = None,
+                                 timeout: float = None,
+                                 rate_limiter: HostRateLimiter = None):
+    """get certain bet company odd"""
+
+    if odd == "yp":
+        url = YP_URL.format(qtw_match_id=match_id, company_id=company_id)
+    elif odd == "dxq":
+        url = DXQ_URL.format(qtw_match_id=match_id, company_id=company_id)
+    else:
+        return "odds type must be in ['yp', 'dxq']"
+
+    headers1 = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.6; '
+                      'rv:2.0.1) Gecko/20100101 Firefox/4.0.1'
+    }
+
+    try:
+        if rate_limiter is not None:
+            rate_limiter.wait(url)
+        content = get_transport().get(
+            url, headers=headers1, session=session, timeout=timeout)
+        page = BeautifulSoup(content.content, "lxml")
+        odds2_lst = page.find_all(id="odds2")
+        td_lst = odds2_lst[0].find_all("tr")[1].find_all("td")
+
+        if td_lst[-1].text.encode("utf-8") != "滚":
+            return td_lst[3].text
+        else:
+            return "match have begin!"
+
+    except Exception as e:
+        logger.exception(e)
+        logger.error(
+            "get qtw_match_id = {0} odds failure".format(match_id))
+        return None
+
+
+def get_latest_odds_by_qtw_match_id(qtw_match_id: int, odd_type: str,
+                                    session: requests.Session = None,
+                                    timeout: float = None,
+                                    rate_limiter: HostRateLimiter = None):
     """
     according to qtw match id get latest odds
     :param qtw_match_id:
     :param odd_type: "yp" or "dxq"
-    :return:
+    :param session: shared http session, None --> a new connection per call
+    :param timeout: seconds of each http request
+    :param rate_limiter: per host rate limit of the http requests
+    :return: odd of the first company in QTW_COMPANY_BET which has one
     """
 
-    def get_latest_odd_by_company_id(match_id: int, company_id: int, odd: str):
-        """get certain bet company odd"""
+    for company_id_value in QTW_COMPANY_BET:
+        rtn = get_latest_odd_by_company_id(
+            match_id=qtw_match_id, company_id=company_id_value, odd=odd_type,
+            session=session, timeout=timeout, rate_limiter=rate_limiter)
+        if rtn is not None:
+            return rtn
+    else:
+        return None
 
-        if odd == "yp":
-            url = YP_URL.format(qtw_match_id=match_id, company_id=company_id)
-        elif odd == "dxq":
-            url = DXQ_URL.format(qtw_match_id=match_id, company_id=company_id)
-        else:
-            return "odds type must be in ['yp', 'dxq']"
 
-        headers1 = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.6; '
-                          'rv:2.0.1) Gecko/20100101 Firefox/4.0.1'
-        }
+def get_latest_odds_batch(
+        qtw_match_ids: typing.Iterable[int],
+        odd_types: typing.Iterable[str] = ("yp", "dxq"),
+        max_workers: int = ODDS_MAX_WORKERS, timeout: float = ODDS_TIMEOUT,
+        min_interval: float = ODDS_HOST_INTERVAL
+) -> typing.Dict[typing.Tuple[int, str], typing.Union[str, None]]:
+    """
+    get latest odds of a slate of matches concurrently over one pooled
+    session
+    :param qtw_match_ids: qtw match ids
+    :param odd_types: "yp" and / or "dxq"
+    :param max_workers: number of concurrent requests
+    :param timeout: seconds of each http request
+    :param min_interval: min seconds between two requests to a host
+    :return: {(qtw_match_id, odd_type): odd of the first company in
+        QTW_COMPANY_BET which has one, or None}
+    """
+    keys = [(int(match_id), odd_type)
+            for match_id in qtw_match_ids for odd_type in odd_types]
+    if not keys:
+        return {}
+
+    session = pooled_session(max_workers)
+    rate_limiter = HostRateLimiter(min_interval)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                key: executor.submit(
+                    get_latest_odds_by_qtw_match_id, key[0], key[1],
+                    session, timeout, rate_limiter)
+                for key in keys}
+            result = {key: future.result() for key, future in futures.items()}
+    finally:
+        session.close()
+
+    return result
+
+
+def match_info_operation(match_information: list, game_week: int,
+                         existing_status: typing.Union[int, None]):
+    """
+    mongodb write of a single match of the season payload
+    :param match_information: match array of the qtw season js
+    :param game_week: game week of the match
+    :param existing_status: status of the match in mongodb, None --> new
+    :return: UpdateOne or None when the match needs no write
+    """
+    qtw_match_id = int(match_information[0])
 
-        try:
-            content = requests.get(url, headers=headers1)
-            page = BeautifulSoup(content.content, "lxml")
-            odds2_lst = page.find_all(id="odds2")
-            td_lst = odds2_lst[0].find_all("tr")[1].find_all("td")
+    if existing_status == 2:
+        return None
+    elif existing_status is not None:
+        if match_information[2] == -1:
+            score_lst = match_information[6].split("-")
+            new_values = {
+                "match_time": match_information[3],
+                "status": 2,
+                "status_text": "Played",
+                "home_score": int(score_lst[0]),
+                "away_score": int(score_lst[1])
+            }
+        elif match_information[2] == -14:
+            new_values = {
+                "match_time": match_information[3],
+                "status": 3,
+                "status_text": "Delay"
+            }
+        else:
+            new_values = {
+                "match_time": match_information[3],
+                "status": 3,
+                "status_text": "Fixture"
+            }
+        logger.info(
+            "qtw_match_id = {0} will be updated!".format(qtw_match_id))
+    else:
+        new_values = dict()
+        new_values["qtw_match_id"] = qtw_match_id
+        new_values["qtw_league_id"] = int(match_information[1])
+        new_values["match_time"] = match_information[3]
+        new_values["home_id"] = int(match_information[4])
+        new_values["away_id"] = int(match_information[5])
+        new_values["game_week"] = int(game_week)
+        if match_information[2] == -1:
+            score_lst = match_information[6].split("-")
+            new_values["home_score"] = int(score_lst[0])
+            new_values["away_score"] = int(score_lst[1])
+            new_values["status"] = 2
+            new_values["status_text"] = "Played"
+        elif match_information[2] == -14:
+            new_values["home_score"] = -1
+            new_values["away_score"] = -1
+            new_values["status"] = 3
+            new_values["status_text"] = "Delay"
+        else:
+            new_values["home_score"] = -1
+            new_values["away_score"] = -1
+            new_values["status"] = 1
+            new_values["status_text"] = "Fixture"
+        logger.info("result_dict = {0}".format(new_values))
 
-            if td_lst[-1].text.encode("utf-8") != "滚":
-                return td_lst[3].text
-            else:
-                return "match have begin!"
+    return UpdateOne({"qtw_match_id": qtw_match_id}, {"$set": new_values},
+                     upsert=True)
 
-        except Exception as e:
-            logger.exception(e)
-            logger.error(
-                "get qtw_match_id = {0} odds failure".format(qtw_match_id))
-            return None
 
-    for company_id_value in QTW_COMPANY_BET:
-        rtn = get_latest_odd_by_company_id(
-            match_id=qtw_match_id, company_id=company_id_value, odd=odd_type)
-        if rtn is not None:
-            return rtn
+def bulk_save_match_info(tb: Collection, week_match_lst: typing.List[
+        typing.Tuple[int, list]]):
+    """
+    write the matches of a season payload with a single projected read and
+    a single bulk write, played matches are skipped
+    :param tb: match_info collection
+    :param week_match_lst: [(game_week, match array), ...]
+    """
+    qtw_match_id_lst = [int(match_information[0])
+                        for _, match_information in week_match_lst]
+    existing = {
+        result["qtw_match_id"]: result["status"]
+        for result in tb.find(
+            filter={"qtw_match_id": {"$in": qtw_match_id_lst}},
+            projection={"_id": 0, "qtw_match_id": 1, "status": 1})
+    }
+
+    operations = []
+    for game_week, match_information in week_match_lst:
+        operation = match_info_operation(
+            match_information, game_week,
+            existing.get(int(match_information[0])))
+        if operation is not None:
+            operations.append(operation)
+
+    if operations:
+        result = tb.bulk_write(operations, ordered=False)
+        logger.info("match info: {0} inserted, {1} updated".format(
+            result.upserted_count, result.modified_count))
     else:
+        logger.info("no match info need update !!!")
+
+
+def get_crawl_state(db_client: MongoClient, league_name: str) -> dict:
+    """
+    watermark of the incremental crawl of the league
+    :return: None when the league has no watermark of the current season,
+        the watermark is dropped with the season url it was built from
+    """
+    tb = db_client["xscore"]["crawl_state"]
+    state = tb.find_one(filter={"league_name": league_name},
+                        projection={"_id": 0})
+    if state is None:
         return None
 
+    season_url_key = season_page_url(league_name, "")
+    if state.get("season_url") != season_url_key:
+        logger.info("{0} season url changed, crawl watermark reset".format(
+            league_name))
+        tb.delete_one({"league_name": league_name})
+        return None
+
+    return state
+
+
+def next_crawl_state(state: typing.Optional[dict], week_match_lst: typing.List[
+        typing.Tuple[int, MatchRecord]]) -> typing.Tuple[typing.List[int],
+                                                         dict]:
+    """
+    watermark after writing the rounds of week_match_lst
+    :param state: former watermark, None --> the whole season was crawled
+    :param week_match_lst: [(game_week, match array), ...] of the crawled
+        rounds, the rounds left out are closed rounds of the former watermark
+    :return: game weeks whose matches all have a final status, sorted,
+        {qtw_match_id: game_week} of the matches which can still change
+    """
+    open_matches = {}
+    crawled_weeks = set()
+    for game_week, match_information in week_match_lst:
+        crawled_weeks.add(game_week)
+        if match_information[2] not in QTW_FINAL_STATUS:
+            open_matches[int(match_information[0])] = game_week
+
+    # a round is skipped by the next run once it has no open match, a
+    # cancelled or postponed match keeps only its own round open
+    former_weeks = set(state["closed_weeks"]) if state else set()
+    closed_weeks = (former_weeks | crawled_weeks) - \
+        set(open_matches.values())
+
+    return sorted(closed_weeks), open_matches
+
 
-def save_match_info_to_mongodb(db_client: MongoClient, league_name: str):
+def save_match_info_to_mongodb(db_client: MongoClient, league_name: str,
+                               payload: 'SeasonPayload' = None,
+                               incremental: bool = False):
     """
     save qtw match information data to mongodb
     :param db_client: mongodb client
     :param league_name: league name --> "yc", "dj", "fj", "xj", "yj"
+    :param payload: season payload, None --> load_season_payload
+    :param incremental: only parse and write the rounds which still have a
+        match without a final status and the rounds not crawled yet, the
+        watermark is kept in the crawl_state collection
     :return: run insert into
     """
 
     tb = db_client["xscore"]["match_info"]
-    page_text = spare_url(league_name)
-
-    pattern = re.compile('jh.* = .*]')
-    match_lst = re.findall(pattern, page_text)
-
-    game_week = 0
-    for match_str in match_lst:
-        game_week += 1
-        match_info_str = match_str.replace(",,,", ",'','',")
-        match_info_lst = eval(str(match_info_str).split(" = ")[1])
-        for match_information in match_info_lst:
-            qtw_match_id = int(match_information[0])
-            result = tb.find_one(
-                filter={"qtw_match_id": qtw_match_id},
-                projection={'status': 1}
-            )
-            if result is not None and result["status"] == 2:
-                continue
-            elif result is not None and result["status"] != 2:
-                if match_information[2] == -1:
-                    new_status = 2
-                    new_status_text = "Played"
-                    score_lst = match_information[6].split("-")
-                    tb.update(
-                        {"qtw_match_id": qtw_match_id},
-                        {
-                            "$set": {
-                                "match_time": match_information[3],
-                                "status": new_status,
-                                "status_text": new_status_text,
-                                "home_score": int(score_lst[0]),
-                                "away_score": int(score_lst[1])
-                            }
-                        }
-                    )
-                elif match_information[2] == -14:
-                    new_status = 3
-                    new_status_text = "Delay"
-                    tb.update(
-                        {"qtw_match_id": qtw_match_id},
-                        {
-                            "$set": {
-                                "match_time": match_information[3],
-                                "status": new_status,
-                                "status_text": new_status_text
-                            }
-                        }
-                    )
-                else:
-                    new_status = 3
-                    new_status_text = "Fixture"
-                    tb.update(
-                        {"qtw_match_id": qtw_match_id},
-                        {
-                            "$set": {
-                                "match_time": match_information[3],
-                                "status": new_status,
-                                "status_text": new_status_text
-                            }
-                        }
-                    )
-                logger.info(
-                    "qtw_match_id = {0} have finished update!".format(
-                        qtw_match_id))
-            else:
-                result_dict = dict()
-                result_dict["qtw_match_id"] = qtw_match_id
-                result_dict["qtw_league_id"] = int(match_information[1])
-                result_dict["match_time"] = match_information[3]
-                result_dict["home_id"] = int(match_information[4])
-                result_dict["away_id"] = int(match_information[5])
-                result_dict["game_week"] = int(game_week)
-                if match_information[2] == -1:
-                    score_lst = match_information[6].split("-")
-                    result_dict["home_score"] = int(score_lst[0])
-                    result_dict["away_score"] = int(score_lst[1])
-                    result_dict["status"] = 2
-                    result_dict["status_text"] = "Played"
-                elif match_information[2] == -14:
-                    result_dict["home_score"] = -1
-                    result_dict["away_score"] = -1
-                    result_dict["status"] = 3
-                    result_dict["status_text"] = "Delay"
-                else:
-                    result_dict["home_score"] = -1
-                    result_dict["away_score"] = -1
-                    result_dict["status"] = 1
-                    result_dict["status_text"] = "Fixture"
-                logger.info("result_dict = {0}".format(result_dict))
-                tb.insert_one(result_dict)
+    if payload is None:
+        payload = load_season_payload(league_name)
 
+    if not incremental:
+        bulk_save_match_info(tb, payload.week_match_lst())
+        return
 
-def save_team_info_to_mongodb(db_client: MongoClient, league_name: str):
+    state = get_crawl_state(db_client, league_name)
+    if state is None:
+        skip = None
+    else:
+        open_weeks = set(state["open_matches"].values())
+        closed_weeks = set(state["closed_weeks"]) - open_weeks
+
+        def skip(game_week: int) -> bool:
+            return game_week in closed_weeks
+
+    week_match_lst = payload.week_match_lst(skip)
+    logger.info("{0}: {1} matches of {2} rounds to crawl".format(
+        league_name, len(week_match_lst),
+        len({game_week for game_week, _ in week_match_lst})))
+    bulk_save_match_info(tb, week_match_lst)
+
+    closed_weeks, open_matches = next_crawl_state(state, week_match_lst)
+    db_client["xscore"]["crawl_state"].update_one(
+        {"league_name": league_name},
+        {"$set": {
+            "league_name": league_name,
+            "season_url": season_page_url(league_name, ""),
+            "closed_weeks": closed_weeks,
+            # mongodb keys are strings
+            "open_matches": {str(k): v for k, v in open_matches.items()},
+            "update_time": datetime.datetime.now()
+        }},
+        upsert=True)
+    logger.info("{0} crawl watermark: {1} closed rounds, {2} open "
+                "matches".format(league_name, len(closed_weeks),
+                                 len(open_matches)))
+
+
+def save_team_info_to_mongodb(db_client: MongoClient, league_name: str,
+                              payload: 'SeasonPayload' = None):
     """
     save qtw team information data to mongodb
     :param db_client: mongodb client
     :param league_name: league name --> "yc", "dj", "fj", "xj", "yj"
+    :param payload: season payload, None --> load_season_payload
     :return: run insert into
     """
 
     tb = db_client["xscore"]["team_info"]
     league_id = int(SUPPORT_LEAGUE_NAME_ID[league_name])
-    page_text = spare_url(league_name)
+    if payload is None:
+        payload = load_season_payload(league_name)
 
-    pattern = re.compile("arrTeam = .*]")
-    match_str = re.search(pattern, page_text)
-    match_group = match_str.group()
-    team_information_lst = eval(str(match_group).split(" = ")[1])
+    team_information_lst = payload.teams()
 
     for team_information in team_information_lst:
         team_id = int(team_information[0])
@@ -274,13 +483,57 @@ def save_league_info_to_mongodb(db_client: MongoClient):
         logger.info("no league info need update !!!")
 
 
-def spare_url(league_name: str):
-    """spare url"""
-
+def get_version_value() -> str:
+    """hourly version value of the season js url, such as 2018121810"""
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    version_value = now.split(":")[0].replace("-", "").replace(" ", "")
+    return now.split(":")[0].replace("-", "").replace(" ", "")
+
+
+def season_page_url(league_name: str, version_value: str) -> str:
+    """season js url of the league"""
     league_id = SUPPORT_LEAGUE_NAME_ID[league_name]
 
+    if league_name in ['yc', 'dj', 'fj', 'xj', 'yj', 'sc']:
+        season_home_page_url = SEASON_URL.format(
+            id=league_id, value=version_value)
+    else:
+        season_home_page_url = SPECIAL_SEASON_URL[league_name].format(
+            value=version_value)
+
+    return season_home_page_url
+
+
+def spare_url(league_name: str, cache_dir: str = SEASON_CACHE_DIR):
+    """
+    spare url, download the season js text of the league
+    the last page is kept under cache_dir, within the same hourly version it
+    is reused without any request, otherwise it is revalidated with a
+    conditional get (ETag / Last-Modified)
+    """
+
+    version_value = get_version_value()
+    season_home_page_url = season_page_url(league_name, version_value)
+    # the url without the version value identifies the season
+    season_url_key = season_page_url(league_name, "")
+
+    text_file = os.path.join(cache_dir, "{0}.js".format(league_name))
+    meta_file = os.path.join(cache_dir, "{0}.json".format(league_name))
+    meta = {}
+    if os.path.exists(text_file) and os.path.exists(meta_file):
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("url") != season_url_key:
+            meta = {}
+
+    transport = get_transport()
+    if transport.mode != 'live':
+        # every page goes through the archive
+        meta = {}
+    elif meta.get("version") == version_value:
+        logger.info("{0} season page is up to date".format(league_name))
+        with open(text_file, encoding="utf-8") as f:
+            return f.read()
+
     headers1 = {
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.6; rv:2.0.1) '
                       'Gecko/20100101 Firefox/4.0.1'
@@ -296,28 +549,90 @@ def spare_url(league_name: str):
         'Accept-Encoding': 'gzip, deflate',
         'Accept-Language': 'zh-CN,zh;q=0.9'
     }
+    if meta.get("etag"):
+        headers2["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers2["If-Modified-Since"] = meta["last_modified"]
 
     session = requests.Session()
 
     league_home_page_url = LEAGUE_URL.format(
         league_id=SUPPORT_LEAGUE_NAME_ID[league_name]
     )
-    session.get(league_home_page_url, headers=headers1)
+    transport.get(league_home_page_url, headers=headers1, session=session)
 
-    if league_name in ['yc', 'dj', 'fj', 'xj', 'yj', 'sc']:
-        season_home_page_url = SEASON_URL.format(
-            id=league_id, value=version_value)
+    chi = transport.get(season_home_page_url, headers=headers2,
+                        session=session)
+
+    if chi.status_code == 304 and meta:
+        logger.info("{0} season page not modified".format(league_name))
+        with open(text_file, encoding="utf-8") as f:
+            page_text = f.read()
     else:
-        season_home_page_url = SPECIAL_SEASON_URL[league_name].format(
-            value=version_value)
+        page = BeautifulSoup(chi.text, "lxml")
+        page_text = page.p.text
 
-    chi = session.get(season_home_page_url, headers=headers2)
-    page = BeautifulSoup(chi.text, "lxml")
-    page_text = page.p.text
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(text_file, "w", encoding="utf-8") as f:
+            f.write(page_text)
+
+    meta = {
+        "url": season_url_key,
+        "version": version_value,
+        "etag": chi.headers.get("ETag", meta.get("etag")),
+        "last_modified": chi.headers.get(
+            "Last-Modified", meta.get("last_modified"))
+    }
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
 
     return page_text
 
 
+class SeasonPayload:
+    def __init__(self, league_name: str, page_text: str):
+        """
+        season js of a league, shared by team and match ingestion
+        :param league_name: league name --> "yc", "dj", "fj", "xj", "yj"
+        :param page_text: season js text
+        """
+        self.league_name = league_name
+        self.page_text = page_text
+        self._teams = None
+
+    def teams(self) -> typing.List[TeamRecord]:
+        if self._teams is None:
+            self._teams = parse_teams(self.page_text)
+        return self._teams
+
+    def rounds(self, skip: typing.Callable[[int], bool] = None):
+        """
+        (game_week, key, [MatchRecord, ...]) of every round
+        :param skip: skip(game_week) is True --> the round is not parsed
+        """
+        return iter_rounds(self.page_text, skip)
+
+    def week_match_lst(self, skip: typing.Callable[[int], bool] = None
+                       ) -> typing.List[typing.Tuple[int, MatchRecord]]:
+        return [(game_week, match_information)
+                for game_week, _, match_info_lst in self.rounds(skip)
+                for match_information in match_info_lst]
+
+
+# season payloads downloaded by this run
+_SEASON_PAYLOADS = {}
+
+
+def load_season_payload(league_name: str,
+                        refresh: bool = False) -> SeasonPayload:
+    """season payload of the league, downloaded at most once per run"""
+    if refresh or league_name not in _SEASON_PAYLOADS:
+        _SEASON_PAYLOADS[league_name] = SeasonPayload(
+            league_name, spare_url(league_name))
+    return _SEASON_PAYLOADS[league_name]
+
+
 # Another way of code implementation
 
 class CrawlDataBase:
@@ -348,48 +663,8 @@ class CrawlDataBase:
         return client
 
     def spare_url(self):
-        """spare url"""
-
-        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        version_value = now.split(":")[0].replace("-", "").replace(" ", "")
-        league_id = SUPPORT_LEAGUE_NAME_ID[self._league_name]
-
-        headers1 = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.6; '
-                          'rv:2.0.1) Gecko/20100101 Firefox/4.0.1'
-        }
-
-        headers2 = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.6; '
-                          'rv:2.0.1) Gecko/20100101 Firefox/4.0.1',
-            'Host': 'zq.win007.com',
-            'Connection': 'keep-alive',
-            'Accept': '*/*',
-            'Referer': 'http://zq.win007.com/cn/SubLeague/37.html',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'zh-CN,zh;q=0.9'
-        }
-
-        session = requests.Session()
-
-        league_home_page_url = LEAGUE_URL.format(
-            league_id=SUPPORT_LEAGUE_NAME_ID[self._league_name]
-        )
-        session.get(league_home_page_url, headers=headers1)
-
-        if self._league_name in ['yc', 'dj', 'fj', 'xj', 'yj', 'sc']:
-            season_home_page_url = SEASON_URL.format(
-                id=league_id, value=version_value)
-        else:
-            season_home_page_url = SPECIAL_SEASON_URL[
-                self._league_name].format(
-                value=version_value)
-
-        chi = session.get(season_home_page_url, headers=headers2)
-        page = BeautifulSoup(chi.text, "lxml")
-        page_text = page.p.text
-
-        return page_text
+        """spare url, shares the season page download of this run"""
+        return load_season_payload(self._league_name).page_text
 
     def save_info_to_mongodb(self):
         raise NotImplementedError
@@ -420,94 +695,12 @@ class MatchInfo(CrawlDataBase):
         tb = self._db_client["xscore"]["match_info"]
         page_text = self.spare_url()
 
-        pattern = re.compile('jh.* = .*]')
-        match_lst = re.findall(pattern, page_text)
-
-        game_week = 0
-        for match_str in match_lst:
-            game_week += 1
-            match_info_str = match_str.replace(",,,", ",'','',")
-            match_info_lst = eval(str(match_info_str).split(" = ")[1])
-            for match_information in match_info_lst:
-                qtw_match_id = int(match_information[0])
-                result = tb.find_one(
-                    filter={"qtw_match_id": qtw_match_id},
-                    projection={'status': 1}
-                )
-                if result is not None and result["status"] == 2:
-                    continue
-                elif result is not None and result["status"] != 2:
-                    if match_information[2] == -1:
-                        new_status = 2
-                        new_status_text = "Played"
-                        score_lst = match_information[6].split("-")
-                        tb.update(
-                            {"qtw_match_id": qtw_match_id},
-                            {
-                                "$set": {
-                                    "match_time": match_information[3],
-                                    "status": new_status,
-                                    "status_text": new_status_text,
-                                    "home_score": int(score_lst[0]),
-                                    "away_score": int(score_lst[1])
-                                }
-                            }
-                        )
-                    elif match_information[2] == -14:
-                        new_status = 3
-                        new_status_text = "Delay"
-                        tb.update(
-                            {"qtw_match_id": qtw_match_id},
-                            {
-                                "$set": {
-                                    "match_time": match_information[3],
-                                    "status": new_status,
-                                    "status_text": new_status_text
-                                }
-                            }
-                        )
-                    else:
-                        new_status = 3
-                        new_status_text = "Fixture"
-                        tb.update(
-                            {"qtw_match_id": qtw_match_id},
-                            {
-                                "$set": {
-                                    "match_time": match_information[3],
-                                    "status": new_status,
-                                    "status_text": new_status_text
-                                }
-                            }
-                        )
-                    logger.info(
-                        "qtw_match_id = {0} have finished update!".format(
-                            qtw_match_id))
-                else:
-                    result_dict = dict()
-                    result_dict["qtw_match_id"] = qtw_match_id
-                    result_dict["qtw_league_id"] = int(match_information[1])
-                    result_dict["match_time"] = match_information[3]
-                    result_dict["home_id"] = int(match_information[4])
-                    result_dict["away_id"] = int(match_information[5])
-                    result_dict["game_week"] = int(game_week)
-                    if match_information[2] == -1:
-                        score_lst = match_information[6].split("-")
-                        result_dict["home_score"] = int(score_lst[0])
-                        result_dict["away_score"] = int(score_lst[1])
-                        result_dict["status"] = 2
-                        result_dict["status_text"] = "Played"
-                    elif match_information[2] == -14:
-                        result_dict["home_score"] = -1
-                        result_dict["away_score"] = -1
-                        result_dict["status"] = 3
-                        result_dict["status_text"] = "Delay"
-                    else:
-                        result_dict["home_score"] = -1
-                        result_dict["away_score"] = -1
-                        result_dict["status"] = 1
-                        result_dict["status_text"] = "Fixture"
-                    logger.info("result_dict = {0}".format(result_dict))
-                    tb.insert_one(result_dict)
+        week_match_lst = [
+            (game_week, match_information)
+            for game_week, _, match_info_lst in iter_rounds(page_text)
+            for match_information in match_info_lst]
+
+        bulk_save_match_info(tb, week_match_lst)
 
 
 class TeamInfo(CrawlDataBase):
@@ -519,10 +712,7 @@ class TeamInfo(CrawlDataBase):
         league_id = int(SUPPORT_LEAGUE_NAME_ID[self._league_name])
         page_text = self.spare_url()
 
-        pattern = re.compile("arrTeam = .*]")
-        match_str = re.search(pattern, page_text)
-        match_group = match_str.group()
-        team_information_lst = eval(str(match_group).split(" = ")[1])
+        team_information_lst = parse_teams(page_text)
 
         for team_information in team_information_lst:
             result = tb.find_one(
@@ -0,0 +1,142 @@
+"""
+@Project   : ScoreProbability
+@Module    : diagnostics.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 7:40 PM
+@Desc      : convergence diagnostics of the sampled traces, split R-hat and
+             effective sample size
+"""
+
+import typing
+
+import numpy as np
+import pandas as pd
+
+# R-hat target of a trustworthy fit, the effective sample size target
+# depends on the predictor and is given by the caller
+RHAT_MAX = 1.05
+
+PARAM_NAMES = ['alpha', 'beta', 'lambda_value', 'rho', 'log_strength']
+
+
+def _as_chains(chains) -> np.ndarray:
+    """(chains, draws, params) float array"""
+    chains = np.asarray(chains, dtype=float)
+    return chains.reshape(chains.shape[0], chains.shape[1], -1)
+
+
+def split_chains(chains) -> np.ndarray:
+    """each chain cut into its first and second half --> (2m, n // 2, p)"""
+    chains = _as_chains(chains)
+    half = chains.shape[1] // 2
+    return np.concatenate(
+        [chains[:, :half], chains[:, half:2 * half]], axis=0)
+
+
+def rhat(chains) -> np.ndarray:
+    """
+    Gelman-Rubin potential scale reduction of every param
+    :param chains: (chains, draws, params)
+    :return: (params, ), close to 1 once the chains agree
+    """
+    chains = _as_chains(chains)
+    n = chains.shape[1]
+    within = chains.var(axis=1, ddof=1).mean(axis=0)
+    between = n * chains.mean(axis=1).var(axis=0, ddof=1)
+    var_plus = (n - 1.0) / n * within + between / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(var_plus / within)
+
+
+def split_rhat(chains) -> np.ndarray:
+    """R-hat of the split chains, also detects a drifting single chain"""
+    return rhat(split_chains(chains))
+
+
+def _autocovariance(x: np.ndarray) -> np.ndarray:
+    """autocovariance of every column of x (draws, params) by fft"""
+    n = x.shape[0]
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    centered = x - x.mean(axis=0)
+    spectrum = np.fft.rfft(centered, n=size, axis=0)
+    return np.fft.irfft(spectrum * np.conjugate(spectrum), n=size,
+                        axis=0)[:n] / n
+
+
+def effective_sample_size(chains) -> np.ndarray:
+    """
+    effective sample size of every param over all chains, autocorrelation
+    summed up to the first negative pair (Geyer initial positive sequence)
+    :param chains: (chains, draws, params)
+    :return: (params, )
+    """
+    chains = split_chains(chains)
+    m, n, p = chains.shape
+    if n < 4:
+        return np.zeros(p)
+
+    acov = np.array([_autocovariance(chain) for chain in chains])
+    within = acov[:, 0].mean(axis=0) * n / (n - 1.0)
+    var_plus = within * (n - 1.0) / n
+    if m > 1:
+        var_plus = var_plus + chains.mean(axis=1).var(axis=0, ddof=1)
+
+    ess = np.zeros(p)
+    for k in range(p):
+        if var_plus[k] <= 0:
+            continue
+        rho = 1.0 - (within[k] - acov[:, :, k].mean(axis=0)) / var_plus[k]
+        rho[0] = 1.0
+        pairs = rho[:-1:2] + rho[1::2]
+        negative = np.nonzero(pairs < 0)[0]
+        if len(negative):
+            pairs = pairs[:negative[0]]
+        tau = -1.0 + 2.0 * pairs.sum()
+        ess[k] = m * n / max(tau, 1.0 / np.log10(m * n))
+    return ess
+
+
+def trace_summary(chain_traces: typing.List[typing.Dict[str, np.ndarray]],
+                  teams: typing.List[str]) -> pd.DataFrame:
+    """
+    mean, sd, R-hat and effective sample size of every param
+    :param chain_traces: traces of every chain --> {'alpha': (draws, teams),
+        'beta': (draws, teams), 'lambda_value': (draws, )}, plus
+        'rho': (draws, ) of dixon_coles and 'log_strength': (draws,
+        leagues - 1) of a joint fit, one chain is checked with its split
+        halves
+    :param teams: team of every column of alpha and beta
+    :return: data frame --> param, team, mean, sd, rhat, ess
+    """
+    draws = min(len(traces['lambda_value']) for traces in chain_traces)
+    columns, rows = [], []
+    for name in [name for name in PARAM_NAMES if name in chain_traces[0]]:
+        values = np.array([
+            np.asarray(traces[name])[-draws:].reshape(draws, -1)
+            for traces in chain_traces])
+        columns.append(values)
+        labels = teams if name in ['alpha', 'beta'] \
+            else [''] * values.shape[2]
+        rows.extend((name, label) for label in labels)
+
+    chains = np.concatenate(columns, axis=2)
+    merged = chains.reshape(-1, chains.shape[2])
+
+    summary = pd.DataFrame(rows, columns=['param', 'team'])
+    summary['mean'] = merged.mean(axis=0)
+    summary['sd'] = merged.std(axis=0)
+    summary['rhat'] = split_rhat(chains)
+    summary['ess'] = effective_sample_size(chains)
+    return summary
+
+
+def converged(summary: pd.DataFrame, ess_min: float,
+              rhat_max: float = RHAT_MAX) -> bool:
+    """
+    every param within the R-hat and effective sample size targets
+    :param summary: trace_summary of the chains
+    :param ess_min: min effective sample size of every param
+    :param rhat_max: max split R-hat of every param
+    """
+    return bool((summary['rhat'] <= rhat_max).all() and
+                (summary['ess'] >= ess_min).all())
@@ -9,22 +9,18 @@
 import typing
 
 import loguru
+import numpy as np
+import pandas as pd
 from pymongo import MongoClient
 
 from base import SUPPORT_LEAGUE_NAME_ID, get_fixture_data
 from base import team_id_cn_name_by_league_id
-from crawl import get_latest_odds_by_qtw_match_id
-
-O3_DICT = {
-    '平手': 0, '平手/半球': -0.25, '半球': -0.5, '半球/一球': -0.75,
-    '一球': -1, '一球/球半': -1.25, '球半': -1.5, '球半/两球': -1.75,
-    '两球': -2, '两球/两球半': -2.25, '两球半': -2.5, '两球半/三球': -2.75,
-    '三球': -3, '三球/三球半': -3.25, '三球半': -3.5, '三球半/四球': -3.75,
-    '四球': -4, '受让平手/半球': 0.25, '受让半球': 0.5, '受让半球/一球': 0.75,
-    '受让一球': 1, '受让一球/球半': 1.25, '受让球半': 1.5, '受让球半/两球': 1.75,
-    '受让两球': 2, '受让两球/两球半': 2.25, '受让两球半': 2.5, '受让两球半/三球': 2.75,
-    '受让三球': 3, '受让三球/三球半': 3.25, '受让三球半': 3.5, '受让三球半/四球': 3.75,
-}
+from crawl import get_latest_odds_batch, get_latest_odds_by_qtw_match_id
+from market import O3_DICT, OVER_UNDER_OUTCOMES, RESULT_OUTCOMES
+from market import batch_market_probs, handicap_line, handicap_mask
+from market import GOAL_LIMIT, market_probs, over_under_line
+from market import over_under_mask, score_grid
+from score_store import SCORE_FIELDS, decode_score
 
 logger = loguru.logger
 
@@ -35,170 +31,143 @@ def get_gauss_model_result_from_mongodb(
     model_tb = db_client["xscore"]["model_gauss"]
     result = model_tb.find_one(
         filter={"qtw_match_id": qtw_match_id},
-        projection={"score": 1, "home_id": 1, "away_id": 1}
+        projection=dict({"home_id": 1, "away_id": 1},
+                        **{field: 1 for field in SCORE_FIELDS})
     )
     return result
 
 
-def get_score_pairs(odd_value: float) -> typing.Dict[str, list]:
-    """
-    according odd value to get the number of goals scored by the home and away
-    team in the following situation, such as win, draw, lose
-    :param odd_value:
-        str = '-0.5' express 'half goal', that is home team let the half goal
-    :return: dict
-        result = {
-                    'home_win': ["1:0", "2:0", "2:1", ...],
-                    'draw': [],
-                    'away_win': ["0:0", "1:1", "1:2", ...]
-                 }
-    """
-
-    result = {}
-    home_win, draw, away_win = [], [], []
-
-    # i -> the number of goals scored by the home team
-    # j -> the number of goals scored by the away team
-    for i in range(11):
-        for j in range(10):
-            score_pair = ":".join([str(i), str(j)])
-            if float(i) - float(j) + float(odd_value) > 0:
-                home_win.append(score_pair)
-            elif float(i) - float(j) + float(odd_value) == 0:
-                draw.append(score_pair)
-            else:
-                away_win.append(score_pair)
-
-    result['home_win'] = home_win
-    result['draw'] = draw
-    result['away_win'] = away_win
-
-    return result
+def get_gauss_model_results_from_mongodb(
+        db_client: MongoClient,
+        qtw_match_id_lst: typing.List[int]) -> typing.Dict[int, dict]:
+    """score prob docs of a slate, one query --> {qtw_match_id: doc}"""
+    model_tb = db_client["xscore"]["model_gauss"]
+    result = model_tb.find(
+        filter={"qtw_match_id": {"$in": [int(match_id)
+                                         for match_id in qtw_match_id_lst]}},
+        projection=dict({"_id": 0, "qtw_match_id": 1},
+                        **{field: 1 for field in SCORE_FIELDS})
+    )
+    return {int(doc["qtw_match_id"]): doc for doc in result}
 
 
-def get_one_prob(score_data: dict, score_pair_result: dict,
-                 type_value: str) -> float:
+def load_slate(db_client: MongoClient, fixture_data: pd.DataFrame,
+               goal_limit: int = GOAL_LIMIT
+               ) -> typing.Tuple[pd.DataFrame, np.ndarray]:
     """
-    according type value to get the prob
-    :param score_data: score pairs prob dict
-    :param score_pair_result: score pairs dict
-    :param type_value: ['home_win', 'draw', 'away_win']
-    :return:
+    join the fixtures of a slate with their model_gauss score matrices
+    :param db_client: mongodb client
+    :param fixture_data: get_fixture_data result
+    :param goal_limit: size of the score grids
+    :return: fixtures with a model result --> qtw_match_id, match_time,
+        home_id, away_id, and their n x k x k score matrices in the same order
     """
-    prob = 0
-    type_list = score_pair_result.get(type_value, None)
-    if type_list is not None:
-        for score_pair in type_list:
-            prob += score_data.get(score_pair, 0.0)
-    prob_value = round(prob, 2)
-    return prob_value
+    slate = fixture_data.drop_duplicates('qtw_match_id')
+    docs = get_gauss_model_results_from_mongodb(
+        db_client, slate.qtw_match_id.tolist())
 
+    missing = ~slate.qtw_match_id.isin(list(docs.keys()))
+    for match_id in slate.qtw_match_id[missing]:
+        logger.error("qtw_match_id = {0} has no model result".format(match_id))
+    slate = slate[~missing].reset_index(drop=True)
 
-def get_310_prob(score_prob_dct: dict) -> typing.Dict[str, float]:
-    """get home win, draw, away win prob"""
+    matrices = np.array([
+        decode_score(docs[int(match_id)], goal_limit)
+        for match_id in slate.qtw_match_id]).reshape(
+        len(slate), goal_limit, goal_limit)
 
-    prob = {}
+    return slate, matrices
 
-    result_dct = get_score_pairs(0)
 
-    type_dict = ['home_win', 'draw', 'away_win']
-    for i in type_dict:
-        prob[i] = get_one_prob(score_prob_dct, result_dct, i)
+def round_prob(probs: np.ndarray, outcomes: list) -> typing.Dict[str, float]:
+    """
+    outcome probs rounded to 2 decimals, the rounding remainder is spread
+    equally over the outcomes
+    """
+    prob = {name: round(float(value), 2)
+            for name, value in zip(outcomes, probs)}
     sum_value = float(sum(prob.values()))
     if sum_value != 1:
         avg_value = round((1 - sum_value) / 3, 2)
-        prob['home_win'] += avg_value
-        prob['draw'] += avg_value
-        prob['away_win'] += avg_value
-
+        for name in outcomes:
+            prob[name] += avg_value
     return prob
 
 
-def get_handicap_prob(qtw_match_id: int, score_prob_dct: dict):
-    """get handicap prob by accordingly odd"""
+def get_310_prob(score_prob_dct: typing.Union[dict, np.ndarray]
+                 ) -> typing.Dict[str, float]:
+    """
+    get home win, draw, away win prob
+    :param score_prob_dct: "i:j" score dict or decode_score matrix
+    """
 
-    prob = {}
+    probs = market_probs(score_grid(score_prob_dct)[None], handicap_mask(0))
+    return round_prob(probs[0], RESULT_OUTCOMES)
 
-    odd_str = get_latest_odds_by_qtw_match_id(qtw_match_id=qtw_match_id,
-                                              odd_type="yp")
 
-    if odd_str is not None:
-        odd_num = O3_DICT[odd_str]
-        result_dct = get_score_pairs(odd_num)
+def get_handicap_prob(qtw_match_id: int,
+                      score_prob_dct: typing.Union[dict, np.ndarray],
+                      odds: dict = None):
+    """
+    get handicap prob by accordingly odd
+    :param odds: prefetched get_latest_odds_batch result, None --> fetch
+    """
 
-        type_dict = ['home_win', 'draw', 'away_win']
-        for i in type_dict:
-            prob[i] = get_one_prob(score_prob_dct, result_dct, i)
-        sum_value = float(sum(prob.values()))
-        if sum_value != 1:
-            avg_value = round((1 - sum_value) / 3, 2)
-            prob['home_win'] += avg_value
-            prob['draw'] += avg_value
-            prob['away_win'] += avg_value
+    if odds is not None:
+        odd_str = odds.get((int(qtw_match_id), "yp"))
     else:
+        odd_str = get_latest_odds_by_qtw_match_id(
+            qtw_match_id=qtw_match_id, odd_type="yp")
+
+    if odd_str is None:
         return None, None
 
-    return odd_str, prob
+    probs = market_probs(score_grid(score_prob_dct)[None],
+                         handicap_mask(handicap_line(odd_str)))
+    return odd_str, round_prob(probs[0], RESULT_OUTCOMES)
 
 
-def get_dxq_score_pairs(odds: float) -> typing.Dict[str, list]:
+def get_dxq_prob(qtw_match_id: int,
+                 score_prob_dct: typing.Union[dict, np.ndarray],
+                 odds: dict = None):
     """
-    according odd value to get the number of goals scored by the home and away
-    team in the following situation, such as big, draw, small
-    :param odds: 2.5
-    :return: dict
-             result = {'home_win': [(1, 0), (2, 0), ...],
-                       'draw': [],
-                       'away_win': []}
+    get dxq prob by accordingly odd
+    :param odds: prefetched get_latest_odds_batch result, None --> fetch
     """
-    result = {}
-
-    big_lst, draw_lst, small_lst = [], [], []
-    for i in range(11):
-        for j in range(11):
-            score_pair = ":".join([str(i), str(j)])
-            if float(i) + float(j) - float(odds) > 0:
-                big_lst.append(score_pair)
-            elif float(i) + float(j) - float(odds) == 0:
-                draw_lst.append(score_pair)
-            else:
-                small_lst.append(score_pair)
-
-    result['big'] = big_lst
-    result['draw'] = draw_lst
-    result['small'] = small_lst
-
-    return result
 
+    if odds is not None:
+        odd_str = odds.get((int(qtw_match_id), "dxq"))
+    else:
+        odd_str = get_latest_odds_by_qtw_match_id(
+            qtw_match_id=qtw_match_id, odd_type="dxq")
 
-def get_dxq_prob(qtw_match_id: int, score_prob_dct: dict):
-    """get dxq prob by accordingly odd"""
+    if odd_str is None:
+        return None, None
 
-    prob = {}
+    probs = market_probs(score_grid(score_prob_dct)[None],
+                         over_under_mask(over_under_line(odd_str)))
+    return odd_str, round_prob(probs[0], OVER_UNDER_OUTCOMES)
 
-    odd_str = get_latest_odds_by_qtw_match_id(qtw_match_id=qtw_match_id,
-                                              odd_type="dxq")
-    if odd_str is not None:
-        if "/" in odd_str:
-            odd_lst = odd_str.split("/")
-            odd_num = (float(odd_lst[0]) + float(odd_lst[1])) / 2
-        else:
-            odd_num = float(odd_str)
-        result_dct = get_dxq_score_pairs(odd_num)
-
-        type_dict = ['big', 'draw', 'small']
-        for i in type_dict:
-            prob[i] = get_one_prob(score_prob_dct, result_dct, i)
-        sum_value = float(sum(prob.values()))
-        if sum_value != 1:
-            avg_value = round((1 - sum_value) / 3, 2)
-            prob['big'] += avg_value
-            prob['draw'] += avg_value
-            prob['small'] += avg_value
-    else:
-        return None, None
 
-    return odd_str, prob
+def slate_market_probs(matrices: np.ndarray, yp_odds: list, dxq_odds: list):
+    """
+    310, handicap and dxq probs of a whole slate
+    :param matrices: n x k x k score matrices
+    :param yp_odds: handicap odd string of every match, None / nan --> no
+        odds
+    :param dxq_odds: dxq odd string of every match, None / nan --> no odds
+    :return: three n x 3 arrays, nan rows for the matches without odds
+    """
+    prob_310 = market_probs(matrices, handicap_mask(0, matrices.shape[-1]))
+    prob_handicap = batch_market_probs(
+        matrices, [handicap_line(odd_str) if odd_str in O3_DICT else None
+                   for odd_str in yp_odds],
+        handicap_mask)
+    prob_dxq = batch_market_probs(
+        matrices, [over_under_line(odd_str) if isinstance(odd_str, str)
+                   else None for odd_str in dxq_odds],
+        over_under_mask)
+    return prob_310, prob_handicap, prob_dxq
 
 
 def league_display(db_client: MongoClient, league_name: str, start_time: str,
@@ -213,37 +182,43 @@ def league_display(db_client: MongoClient, league_name: str, start_time: str,
     if fixture_data.empty:
         return None
 
-    total_qtw_match_id = fixture_data.qtw_match_id.unique()
+    slate, matrices = load_slate(db_client, fixture_data)
+
+    # yp and dxq odds of the whole slate, fetched concurrently
+    odds = get_latest_odds_batch(slate.qtw_match_id.tolist())
+
     print("*************************************************")
     print("*********         {0}         *********".format(league_name))
     print("*************************************************")
 
-    for match_id in total_qtw_match_id:
-        logger.info("Start display qtw_match_id = {0}".format(match_id))
+    slate['yp'] = [odds.get((int(match_id), "yp"))
+                   for match_id in slate.qtw_match_id]
+    slate['dxq'] = [odds.get((int(match_id), "dxq"))
+                    for match_id in slate.qtw_match_id]
+    prob_310_lst, prob_handicap_lst, prob_dxq_lst = slate_market_probs(
+        matrices, slate['yp'].tolist(), slate['dxq'].tolist())
 
-        gauss_result = get_gauss_model_result_from_mongodb(
-            db_client=db_client, qtw_match_id=int(match_id))
+    for row, match in enumerate(slate.itertuples(index=False)):
+        match_id = match.qtw_match_id
+        logger.info("Start display qtw_match_id = {0}".format(match_id))
 
-        score_prob_dct = gauss_result["score"]
-        home_id, away_id = gauss_result["home_id"], gauss_result["away_id"]
         home_away = '{home_team}  VS  {away_team}    '.format(
-            home_team=team_id_to_cn_name[home_id],
-            away_team=team_id_to_cn_name[away_id])
+            home_team=team_id_to_cn_name[match.home_id],
+            away_team=team_id_to_cn_name[match.away_id])
 
         # display match time
-        match_time = fixture_data.loc[fixture_data['qtw_match_id'] == match_id,
-                                      ['match_time']].values[0][0]
         print('{home_away}{match_time}'.format(
-            home_away=home_away, match_time=match_time))
+            home_away=home_away, match_time=match.match_time))
 
         # 310 result
-        prob_310 = get_310_prob(score_prob_dct)
+        prob_310 = round_prob(prob_310_lst[row], RESULT_OUTCOMES)
         print('{home_away}{odd}    {prob}'.format(
             home_away=home_away, odd="310", prob=prob_310))
 
         # handicap result
-        yp_odd, prob_handicap = get_handicap_prob(match_id, score_prob_dct)
-        if yp_odd is not None:
+        yp_odd = match.yp
+        if not np.isnan(prob_handicap_lst[row, 0]):
+            prob_handicap = round_prob(prob_handicap_lst[row], RESULT_OUTCOMES)
             print('{home_away}{odd}    {prob}'.format(
                 home_away=home_away, odd=yp_odd,
                 prob=prob_handicap))
@@ -251,8 +226,9 @@ def league_display(db_client: MongoClient, league_name: str, start_time: str,
             print("get qtw_match_id = {0} yp odds failure".format(match_id))
 
         # dxq result
-        dxq_odd, prob_dxq = get_dxq_prob(match_id, score_prob_dct)
-        if dxq_odd is not None:
+        dxq_odd = match.dxq
+        if not np.isnan(prob_dxq_lst[row, 0]):
+            prob_dxq = round_prob(prob_dxq_lst[row], OVER_UNDER_OUTCOMES)
             print('{home_away}{odd}    {prob}'.format(
                 home_away=home_away, odd=dxq_odd, prob=prob_dxq))
 
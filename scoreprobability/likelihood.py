@@ -0,0 +1,337 @@
+"""
+@Project   : ScoreProbability
+@Module    : likelihood.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 11:10 AM
+@Desc      : vectorized time weighted poisson and dixon-coles likelihood,
+             league strength offsets of the joint fit and the fast maximum
+             a posteriori fitting engine
+"""
+
+import typing
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.special import gammaln
+
+from base import TeamIndex
+
+# time weighting --> 0.5 ** (days / half_life), the default is the same
+# weighting as exp(-days * 0.01)
+DEFAULT_HALF_LIFE = np.log(2) / 0.01
+
+
+def time_weights(dates: pd.Series,
+                 half_life: float = DEFAULT_HALF_LIFE) -> np.ndarray:
+    """
+    time weighting of every played match, relative to the day after the
+    latest match of the data, whatever the row order
+    :param dates: match dates
+    :param half_life: days after which a match counts half, inf --> no decay
+    :return: weights array
+    """
+    dates = pd.to_datetime(pd.Series(dates)).reset_index(drop=True)
+    t_now = dates.max() + pd.Timedelta('1 days 00:00:00')
+    t_diff = (t_now - dates).dt.days.values
+    return np.exp(-t_diff * np.log(2) / float(half_life))
+
+
+# fitting window of a league, missing keys of LEAGUE_FIT_CONFIG fall back to
+# DEFAULT_FIT_CONFIG
+# half_life --> time weighting half life in days
+# lookback_days --> hard limit of the played data age
+# min_weight --> matches whose weight is below it are dropped
+DEFAULT_FIT_CONFIG = {
+    'half_life': DEFAULT_HALF_LIFE, 'lookback_days': 730, 'min_weight': 0.01
+}
+
+# qtw_league_id --> config, such as {36: {'half_life': 120}}
+LEAGUE_FIT_CONFIG = {}
+
+
+def fit_config(qtw_league_id: int = None) -> typing.Dict[str, float]:
+    """fitting window of the league"""
+    return dict(DEFAULT_FIT_CONFIG, **LEAGUE_FIT_CONFIG.get(qtw_league_id, {}))
+
+
+def window_days(half_life: float, lookback_days: float,
+                min_weight: float) -> float:
+    """age in days after which a match is not fitted any more"""
+    if min_weight > 0 and np.isfinite(half_life):
+        return min(lookback_days, half_life * np.log2(1.0 / min_weight))
+    return lookback_days
+
+
+def trim_played_data(data: pd.DataFrame, days: float) -> pd.DataFrame:
+    """
+    drop the matches older than days before the last match of the data
+    :param data: played data --> Date, HomeTeam, AwayTeam, FTHG, FTAG
+    :param days: window_days
+    """
+    if data.empty or not np.isfinite(days):
+        return data
+    dates = pd.to_datetime(data['Date'])
+    keep = (dates >= dates.max() - pd.Timedelta(days=float(days))).values
+    if keep.all():
+        return data
+    return data[keep].reset_index(drop=True)
+
+
+def poisson_log_likelihood(home_rate: np.ndarray, away_rate: np.ndarray,
+                           home_goals: np.ndarray, away_goals: np.ndarray,
+                           weights: np.ndarray) -> float:
+    """
+    time weighted log likelihood sum(w * poisson_logpmf) of both scores of
+    every match
+    """
+    return np.sum(weights * (
+        home_goals * np.log(home_rate) - home_rate -
+        gammaln(home_goals + 1) +
+        away_goals * np.log(away_rate) - away_rate -
+        gammaln(away_goals + 1)))
+
+
+# "poisson": independent home and away goals, "dixon_coles": rho corrects
+# the 0:0, 1:0, 0:1 and 1:1 probabilities
+MODEL_LST = ['poisson', 'dixon_coles']
+
+# rho keeps every tau positive for scoring strengths up to about 4
+RHO_BOUNDS = (-0.2, 0.2)
+
+
+def dixon_coles_tau(home_goals: np.ndarray, away_goals: np.ndarray,
+                    home_rate: np.ndarray, away_rate: np.ndarray,
+                    rho: float) -> np.ndarray:
+    """
+    dixon-coles correction factor of every match, 1 beyond the low scores
+    0:0 --> 1 - home_rate * away_rate * rho, 0:1 --> 1 + home_rate * rho,
+    1:0 --> 1 + away_rate * rho, 1:1 --> 1 - rho
+    """
+    tau = np.ones(len(home_goals))
+    low = (home_goals <= 1) & (away_goals <= 1)
+    x, y = home_goals[low], away_goals[low]
+    lam, mu = home_rate[low], away_rate[low]
+    tau[low] = np.where(
+        x == 0,
+        np.where(y == 0, 1 - lam * mu * rho, 1 + lam * rho),
+        np.where(y == 0, 1 + mu * rho, 1 - rho))
+    return tau
+
+
+def dixon_coles_log_likelihood(home_rate: np.ndarray, away_rate: np.ndarray,
+                               home_goals: np.ndarray, away_goals: np.ndarray,
+                               weights: np.ndarray, rho: float) -> float:
+    """time weighted poisson log likelihood plus sum(w * log tau)"""
+    tau = dixon_coles_tau(home_goals, away_goals, home_rate, away_rate, rho)
+    if (tau <= 0).any():
+        return -np.inf
+    return poisson_log_likelihood(
+        home_rate, away_rate, home_goals, away_goals, weights) + \
+        np.sum(weights * np.log(tau))
+
+
+# Normal(0, 1 / LEAGUE_PRIOR_TAU) prior of the log strength of a league
+LEAGUE_PRIOR_TAU = 1.0
+
+
+def team_leagues(data: pd.DataFrame, teams: typing.List[str]
+                 ) -> typing.Tuple[typing.List[str], np.ndarray]:
+    """
+    league of every team of a joint fit, the league it played most in
+    :param data: joint played data --> HomeTeam, AwayTeam, League
+    :param teams: teams of the fit
+    :return: leagues in sorted order, the first is the reference of the
+        strengths, league code of every team
+    """
+    team_index, league_index = TeamIndex(teams), TeamIndex(data['League'])
+    n, n_leagues = len(team_index), len(league_index)
+
+    team_codes = np.concatenate([team_index.codes(data.HomeTeam),
+                                 team_index.codes(data.AwayTeam)])
+    league_codes = np.tile(league_index.codes(data['League']), 2)
+    counts = np.bincount(team_codes * n_leagues + league_codes,
+                         minlength=n * n_leagues).reshape(n, n_leagues)
+
+    return league_index.teams, counts.argmax(axis=1)
+
+
+def league_scaled(traces: typing.Dict[str, np.ndarray],
+                  team_league: np.ndarray
+                  ) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    alpha * strength and beta / strength of every draw, the attack and
+    defence of a joint fit on a common scale
+    :param traces: traces of a joint fit, with 'log_strength' --> (draws,
+        leagues - 1)
+    :param team_league: league code of every team
+    :return: alpha, beta --> (draws, teams)
+    """
+    alpha, beta = np.asarray(traces['alpha']), np.asarray(traces['beta'])
+    log_strength = np.asarray(traces['log_strength']).reshape(
+        len(alpha), -1)
+    log_strength = np.hstack([np.zeros((len(alpha), 1)), log_strength])
+    strength = np.exp(log_strength)[:, team_league]
+    return alpha * strength, beta / strength
+
+
+def neg_log_posterior(theta: np.ndarray, home_idx: np.ndarray,
+                      away_idx: np.ndarray, home_goals: np.ndarray,
+                      away_goals: np.ndarray, weights: np.ndarray,
+                      prior_rate: float = 1.0, dixon_coles: bool = False,
+                      home_league: np.ndarray = None,
+                      away_league: np.ndarray = None,
+                      n_leagues: int = 1) -> typing.Tuple[float, np.ndarray]:
+    """
+    negative weighted log posterior of the attack/defence/home advantage
+    model and its analytic gradient
+    :param theta: [log alpha (n), log beta (n), log lambda_value], then the
+        log strength of every league but the first, then rho when
+        dixon_coles
+    :param home_idx: home team index of every match
+    :param away_idx: away team index of every match
+    :param home_goals: home team goals of every match
+    :param away_goals: away team goals of every match
+    :param weights: time weighting of every match
+    :param prior_rate: rate of the Gamma(1, rate) prior of every param
+    :param dixon_coles: fit the low score dependence rho, flat prior
+    :param home_league: league code of the home team of every match
+    :param away_league: league code of the away team of every match
+    :param n_leagues: leagues of a joint fit, the home rate is scaled by
+        strength[home_league] / strength[away_league], the away rate by its
+        inverse
+    :return: value, gradient
+    """
+    n_offsets = n_leagues - 1
+    n_rates = len(theta) - n_offsets - (1 if dixon_coles else 0)
+    n = (n_rates - 1) // 2
+    log_alpha, log_beta = theta[:n], theta[n:2 * n]
+    log_gamma = theta[2 * n]
+
+    log_home_rate = log_alpha[home_idx] + log_beta[away_idx] + log_gamma
+    log_away_rate = log_alpha[away_idx] + log_beta[home_idx]
+    if n_offsets:
+        log_strength = np.concatenate(
+            [[0.0], theta[n_rates:n_rates + n_offsets]])
+        log_ratio = log_strength[home_league] - log_strength[away_league]
+        log_home_rate = log_home_rate + log_ratio
+        log_away_rate = log_away_rate - log_ratio
+    home_rate, away_rate = np.exp(log_home_rate), np.exp(log_away_rate)
+
+    log_lik = np.sum(weights * (
+        home_goals * log_home_rate - home_rate - gammaln(home_goals + 1) +
+        away_goals * log_away_rate - away_rate - gammaln(away_goals + 1)))
+
+    # d log_lik / d log_rate of every match
+    home_resid = weights * (home_goals - home_rate)
+    away_resid = weights * (away_goals - away_rate)
+
+    grad = np.zeros_like(theta)
+    if dixon_coles:
+        rho = theta[-1]
+        tau = dixon_coles_tau(home_goals, away_goals, home_rate, away_rate,
+                              rho)
+        tau = np.maximum(tau, 1e-12)
+        log_lik += np.sum(weights * np.log(tau))
+
+        # d log tau / d log_rate and d log tau / d rho of the low scores
+        zero_zero = (home_goals == 0) & (away_goals == 0)
+        zero_one = (home_goals == 0) & (away_goals == 1)
+        one_zero = (home_goals == 1) & (away_goals == 0)
+        one_one = (home_goals == 1) & (away_goals == 1)
+        w_tau = weights / tau
+        rate_product = home_rate * away_rate
+        home_resid = home_resid + w_tau * (
+            zero_one * home_rate * rho - zero_zero * rate_product * rho)
+        away_resid = away_resid + w_tau * (
+            one_zero * away_rate * rho - zero_zero * rate_product * rho)
+        grad[-1] = np.sum(w_tau * (
+            zero_one * home_rate + one_zero * away_rate -
+            zero_zero * rate_product - one_one))
+
+    grad[:n] = np.bincount(home_idx, home_resid, minlength=n) + \
+        np.bincount(away_idx, away_resid, minlength=n)
+    grad[n:2 * n] = np.bincount(away_idx, home_resid, minlength=n) + \
+        np.bincount(home_idx, away_resid, minlength=n)
+    grad[2 * n] = home_resid.sum()
+
+    # Gamma(1, prior_rate) prior --> log p(x) = -prior_rate * x
+    params = np.exp(theta[:n_rates])
+    log_prior = -prior_rate * params.sum()
+    grad[:n_rates] -= prior_rate * params
+
+    if n_offsets:
+        ratio_resid = home_resid - away_resid
+        league_grad = np.bincount(home_league, ratio_resid,
+                                  minlength=n_leagues) - \
+            np.bincount(away_league, ratio_resid, minlength=n_leagues)
+        offsets = log_strength[1:]
+        log_prior -= 0.5 * LEAGUE_PRIOR_TAU * np.sum(offsets ** 2)
+        grad[n_rates:n_rates + n_offsets] = \
+            league_grad[1:] - LEAGUE_PRIOR_TAU * offsets
+
+    return -(log_lik + log_prior), -grad
+
+
+def fit_mle(data: pd.DataFrame, half_life: float = DEFAULT_HALF_LIFE,
+            prior_rate: float = 1.0, weights: np.ndarray = None,
+            model: str = 'poisson'):
+    """
+    fit the model by maximizing the weighted log posterior with scipy
+    :param data: played data --> Date, HomeTeam, AwayTeam, FTHG, FTAG
+    :param half_life: time weighting half life in days
+    :param prior_rate: rate of the Gamma(1, rate) prior of every param
+    :param weights: time weights of the data, None --> time_weights
+    :param model: "poisson" or "dixon_coles"
+    :return: teams, traces with a single draw, the same layout as
+        ScoreProbabilityModel.sample_posterior, plus 'rho' of dixon_coles
+        and 'log_strength' --> (1, leagues - 1) when data has the League
+        column of several leagues, see join_played_data
+    """
+    if model not in MODEL_LST:
+        raise ValueError("model must be in {0}".format(MODEL_LST))
+    dixon_coles = model == 'dixon_coles'
+
+    team_index = TeamIndex.from_data(data)
+    teams, n = team_index.teams, len(team_index)
+
+    home_idx = team_index.codes(data.HomeTeam)
+    away_idx = team_index.codes(data.AwayTeam)
+    home_goals = data.FTHG.values.astype(float)
+    away_goals = data.FTAG.values.astype(float)
+    if weights is None:
+        weights = time_weights(data['Date'], half_life)
+
+    home_league, away_league, n_leagues = None, None, 1
+    if 'League' in data.columns:
+        leagues, team_league = team_leagues(data, teams)
+        home_league, away_league = team_league[home_idx], \
+            team_league[away_idx]
+        n_leagues = len(leagues)
+    n_rates = 2 * n + 1
+
+    bounds = [(None, None)] * (n_rates + n_leagues - 1)
+    if dixon_coles:
+        bounds.append(RHO_BOUNDS)
+
+    result = minimize(
+        neg_log_posterior, np.zeros(len(bounds)), jac=True,
+        method='L-BFGS-B', bounds=bounds,
+        args=(home_idx, away_idx, home_goals, away_goals, weights,
+              prior_rate, dixon_coles, home_league, away_league, n_leagues))
+    if not result.success:
+        raise RuntimeError("mle fit failure: {0}".format(result.message))
+
+    params = np.exp(result.x[:n_rates])
+    traces = {
+        'alpha': params[:n].reshape(1, n),
+        'beta': params[n:2 * n].reshape(1, n),
+        'lambda_value': params[-1:]
+    }
+    if n_leagues > 1:
+        traces['log_strength'] = result.x[
+            n_rates:n_rates + n_leagues - 1].reshape(1, -1)
+    if dixon_coles:
+        traces['rho'] = result.x[-1:]
+
+    return teams, traces
@@ -0,0 +1,165 @@
+"""
+@Project   : ScoreProbability
+@Module    : market.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 5:10 PM
+@Desc      : 1X2, handicap and over / under market probabilities from score
+             matrices, every line is a weight mask over the score grid
+"""
+
+import functools
+import typing
+
+import numpy as np
+
+O3_DICT = {
+    '平手': 0, '平手/半球': -0.25, '半球': -0.5, '半球/一球': -0.75,
+    '一球': -1, '一球/球半': -1.25, '球半': -1.5, '球半/两球': -1.75,
+    '两球': -2, '两球/两球半': -2.25, '两球半': -2.5, '两球半/三球': -2.75,
+    '三球': -3, '三球/三球半': -3.25, '三球半': -3.5, '三球半/四球': -3.75,
+    '四球': -4, '受让平手/半球': 0.25, '受让半球': 0.5, '受让半球/一球': 0.75,
+    '受让一球': 1, '受让一球/球半': 1.25, '受让球半': 1.5, '受让球半/两球': 1.75,
+    '受让两球': 2, '受让两球/两球半': 2.25, '受让两球半': 2.5, '受让两球半/三球': 2.75,
+    '受让三球': 3, '受让三球/三球半': 3.25, '受让三球半': 3.5, '受让三球半/四球': 3.75,
+}
+
+# 0.5, 0.75, ..., 7
+OVER_UNDER_LINES = [value / 4 for value in range(2, 29)]
+
+# score grid size, goals 0 .. GOAL_LIMIT - 1
+GOAL_LIMIT = 11
+
+RESULT_OUTCOMES = ['home_win', 'draw', 'away_win']
+OVER_UNDER_OUTCOMES = ['big', 'draw', 'small']
+
+
+def split_line(line: float) -> typing.Tuple[float, ...]:
+    """
+    the half stake lines of a line
+    :param line: -0.25 --> (0, -0.5), -0.5 --> (-0.5,)
+    """
+    if (line * 4) % 2 == 1:
+        return line - 0.25, line + 0.25
+    return line,
+
+
+def _line_mask(margin: np.ndarray, line: float) -> np.ndarray:
+    """
+    weights of (win, push, lose) of every cell, a quarter line counts half a
+    stake on each of its half stake lines
+    :param margin: k x k goal margin of the bet before the line
+    """
+    lines = split_line(line)
+    mask = np.zeros((3,) + margin.shape)
+    for half_line in lines:
+        value = margin + half_line
+        mask[0] += value > 0
+        mask[1] += value == 0
+        mask[2] += value < 0
+    mask /= len(lines)
+    mask.setflags(write=False)
+    return mask
+
+
+@functools.lru_cache(maxsize=None)
+def handicap_mask(line: float, goal_limit: int = GOAL_LIMIT) -> np.ndarray:
+    """
+    (home_win, draw, away_win) weights of the score grid
+    :param line: handicap of the home team, -0.5 --> home team gives half
+        a goal
+    :param goal_limit: size of the score grid
+    :return: 3 x k x k
+    """
+    goals = np.arange(goal_limit)
+    return _line_mask(goals[:, None] - goals[None, :], line)
+
+
+@functools.lru_cache(maxsize=None)
+def over_under_mask(line: float, goal_limit: int = GOAL_LIMIT) -> np.ndarray:
+    """
+    (big, draw, small) weights of the score grid
+    :param line: total goals line, 2.75 --> half on 2.5 and half on 3
+    :param goal_limit: size of the score grid
+    :return: 3 x k x k
+    """
+    goals = np.arange(goal_limit)
+    return _line_mask(goals[:, None] + goals[None, :], -line)
+
+
+# every line quoted by the odds pages
+for _line in sorted(set(O3_DICT.values())):
+    handicap_mask(float(_line))
+for _line in OVER_UNDER_LINES:
+    over_under_mask(_line)
+
+
+def handicap_line(odd_str: str) -> float:
+    """'半球/一球' --> -0.75"""
+    return float(O3_DICT[odd_str])
+
+
+def over_under_line(odd_str: str) -> float:
+    """'2.5/3' --> 2.75, '2.5' --> 2.5"""
+    if "/" in odd_str:
+        odd_lst = odd_str.split("/")
+        return (float(odd_lst[0]) + float(odd_lst[1])) / 2
+    return float(odd_str)
+
+
+def score_grid(score_dct: typing.Union[dict, np.ndarray],
+               goal_limit: int = GOAL_LIMIT) -> np.ndarray:
+    """
+    k x k matrix of a {"i:j": prob} score dict or of a score matrix, cells
+    outside the grid are dropped
+    """
+    grid = np.zeros((goal_limit, goal_limit))
+    if isinstance(score_dct, np.ndarray):
+        k = min(goal_limit, score_dct.shape[0])
+        grid[:k, :k] = score_dct[:k, :k]
+        return grid
+
+    for score_pair, prob in score_dct.items():
+        i, j = score_pair.split(":")
+        i, j = int(i), int(j)
+        if i < goal_limit and j < goal_limit:
+            grid[i, j] = prob
+    return grid
+
+
+def market_probs(matrices: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    probabilities of the outcomes of a line for a batch of matches
+    :param matrices: n x k x k score matrices
+    :param mask: 3 x k x k weights of the line
+    :return: n x 3
+    """
+    matrices = np.asarray(matrices)
+    n, k = matrices.shape[0], mask.shape[-1]
+    return matrices[:, :k, :k].reshape(n, k * k).dot(mask.reshape(3, k * k).T)
+
+
+def batch_market_probs(matrices: np.ndarray,
+                       lines: typing.Sequence[typing.Optional[float]],
+                       mask_of: typing.Callable[[float, int], np.ndarray]
+                       ) -> np.ndarray:
+    """
+    probabilities of a line per match, one dot product per distinct line
+    :param matrices: n x k x k score matrices
+    :param lines: line of every match, None --> no odds of the match
+    :param mask_of: handicap_mask or over_under_mask
+    :return: n x 3, nan rows for the matches without a line
+    """
+    matrices = np.asarray(matrices)
+    goal_limit = matrices.shape[-1]
+    result = np.full((len(lines), 3), np.nan)
+
+    rows_of_line = {}
+    for row, line in enumerate(lines):
+        if line is not None:
+            rows_of_line.setdefault(line, []).append(row)
+
+    for line, rows in rows_of_line.items():
+        result[rows] = market_probs(
+            matrices[rows], mask_of(line, goal_limit))
+
+    return result
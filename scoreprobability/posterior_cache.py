@@ -0,0 +1,200 @@
+"""
+@Project   : ScoreProbability
+@Module    : posterior_cache.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 10:30 AM
+@Desc      : on-disk cache of the sampled posterior traces of a league
+"""
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+import typing
+
+import loguru
+import numpy as np
+import pandas as pd
+
+logger = loguru.logger
+
+CACHE_FILE_PREFIX = "posterior_"
+CACHE_LOCK_FILE = ".lock"
+
+# eviction defaults, applied per league directory
+MAX_CACHE_FILES = 20
+MAX_CACHE_AGE_DAYS = 30
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+
+class PosteriorCache:
+    def __init__(self, dir_file: str, max_files: int = MAX_CACHE_FILES,
+                 max_age_days: float = MAX_CACHE_AGE_DAYS,
+                 max_bytes: int = MAX_CACHE_BYTES):
+        """
+        Initialization parameters
+        :param dir_file: league output directory, such as 'output/yc/'
+        :param max_files: keep at most this many posterior files
+        :param max_age_days: remove posterior files older than this
+        :param max_bytes: keep the total size of posterior files below this
+        """
+        self.dir_file = dir_file
+        self.max_files = max_files
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def fingerprint(data: pd.DataFrame, settings: dict) -> str:
+        """
+        hash of the played match data and the sampler settings
+        :param data: data frame returned by get_played_data
+        :param settings: sampler settings, such as iter, burn, thin
+        :return: hex digest used as the cache key
+        """
+        sha = hashlib.sha1()
+        sha.update(data.to_csv(index=False).encode("utf-8"))
+        sha.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        return sha.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(
+            self.dir_file, "{0}{1}.npz".format(CACHE_FILE_PREFIX, key))
+
+    def load(self, key: str, since: float = None) -> typing.Union[
+            typing.Tuple[typing.List[str], typing.Dict[str, np.ndarray]],
+            None]:
+        """
+        load the traces stored under key
+        :param since: only a posterior saved at or after this time stamp,
+            such as the one a concurrent refit of a joint union just saved
+        :return: (teams, traces) or None when there is no such posterior
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        if since is not None and modified_time(path) < since:
+            return None
+
+        try:
+            with np.load(path) as npz:
+                # team ids or the team names of a csv fit
+                teams = npz["teams"].tolist()
+                traces = {name: npz[name] for name in npz.files
+                          if name != "teams"}
+        except Exception as e:
+            logger.exception(e)
+            logger.error("posterior cache {0} is broken".format(path))
+            remove_file(path)
+            return None
+
+        # mark as recently used for eviction, unless evicted meanwhile
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        logger.info("posterior cache hit: {0}".format(path))
+
+        return teams, traces
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        hold an exclusive lock on the directory, so that processes sharing
+        it, such as the leagues of a joint fit, sample and save one at a
+        time and a later holder loads the posterior of the first
+        """
+        if not os.path.exists(self.dir_file):
+            os.makedirs(self.dir_file, exist_ok=True)
+
+        with open(os.path.join(self.dir_file, CACHE_LOCK_FILE), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def latest(self) -> typing.Union[
+            typing.Tuple[typing.List[str], typing.Dict[str, np.ndarray]],
+            None]:
+        """
+        the most recently used posterior of the league, whatever its key
+        :return: (teams, traces) or None when the league has no posterior
+        """
+        pattern = os.path.join(
+            self.dir_file, "{0}*.npz".format(CACHE_FILE_PREFIX))
+        paths = sorted(glob.glob(pattern), key=modified_time, reverse=True)
+        for path in paths:
+            key = os.path.basename(path)[len(CACHE_FILE_PREFIX):-len(".npz")]
+            cached = self.load(key)
+            if cached is not None:
+                return cached
+        return None
+
+    def save(self, key: str, teams: typing.List[str],
+             traces: typing.Dict[str, np.ndarray]):
+        """store the traces under key, then apply eviction"""
+        if not os.path.exists(self.dir_file):
+            os.makedirs(self.dir_file, exist_ok=True)
+
+        path = self.path(key)
+        # unique per writer and outside the "<prefix>*.npz" pattern of
+        # latest and evict, the file object keeps savez from adding .npz
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.dir_file, prefix=".{0}".format(key), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, teams=np.array(teams), **traces)
+            os.replace(tmp_path, path)
+        except BaseException:
+            remove_file(tmp_path)
+            raise
+        logger.info("posterior cache saved: {0}".format(path))
+
+        self.evict()
+
+    def evict(self):
+        """remove posterior files by age, count and total size"""
+        pattern = os.path.join(
+            self.dir_file, "{0}*.npz".format(CACHE_FILE_PREFIX))
+        files = []
+        for path in glob.glob(pattern):
+            try:
+                files.append((path, os.stat(path)))
+            except OSError:
+                # removed by another process since the glob
+                continue
+        # newest first
+        files.sort(key=lambda item: item[1].st_mtime, reverse=True)
+
+        now = time.time()
+        max_age = self.max_age_days * 24 * 3600
+        keep, total_bytes = [], 0
+        for path, stat in files:
+            if now - stat.st_mtime > max_age or \
+                    len(keep) >= self.max_files or \
+                    (keep and total_bytes + stat.st_size > self.max_bytes):
+                remove_file(path)
+                logger.info("posterior cache evicted: {0}".format(path))
+            else:
+                keep.append(path)
+                total_bytes += stat.st_size
+
+
+def modified_time(path: str) -> float:
+    """mtime of path, 0 when another process removed it meanwhile"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def remove_file(path: str):
+    """remove path, a file already removed by another process is fine"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,174 @@
+"""
+@Project   : ScoreProbability
+@Module    : qtw_parser.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 2:20 PM
+@Desc      : tokenizer of the qtw season js payload, reads the jh[...] and
+             arrTeam array literals without eval
+"""
+
+import collections
+import re
+import typing
+
+# jh["R_1"] = [[1552193,36,-1,'2018-08-11 03:00',19,59,'2-1',...],...];
+MatchRecord = collections.namedtuple(
+    'MatchRecord', ['qtw_match_id', 'qtw_league_id', 'status', 'match_time',
+                    'home_id', 'away_id', 'score'])
+
+# var arrTeam = [[19,'曼联','曼聯','Manchester United',...],...];
+TeamRecord = collections.namedtuple(
+    'TeamRecord', ['team_id', 'team_cn_name', 'team_tw_name',
+                   'team_en_name'])
+
+# one group per token kind, matched by lastindex
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (-?\d+)(?![.\deE])                      # 1 int
+      | (-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)       # 2 float
+      | '((?:[^'\\]|\\.)*)'                     # 3 single quoted string
+      | "((?:[^"\\]|\\.)*)"                     # 4 double quoted string
+      | (\[)                                   # 5
+      | (\])                                   # 6
+      | (,)                                    # 7
+      | (null|undefined|true|false)            # 8
+      | (.)                                    # 9 anything else
+    )""", re.VERBOSE | re.DOTALL)
+
+_ESCAPE_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+
+# strings and brackets only, enough to find the end of a skipped array
+_SKIP_PATTERN = re.compile(
+    r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|([\[\]])""", re.DOTALL)
+
+_ROUND_PATTERN = re.compile(
+    r"""jh\[\s*(["'])(?P<key>.*?)\1\s*\]\s*=\s*(?=\[)""")
+
+_TEAM_PATTERN = re.compile(r"arrTeam\s*=\s*(?=\[)")
+
+_WORD_VALUE = {'null': None, 'undefined': None, 'true': True, 'false': False}
+
+
+class QtwParseError(ValueError):
+    pass
+
+
+def _string(value: str) -> str:
+    return _ESCAPE_PATTERN.sub(r"\1", value) if '\\' in value else value
+
+
+def parse_array(text: str, pos: int = 0) -> typing.Tuple[list, int]:
+    """
+    parse a js array literal of numbers, strings and nested arrays
+    :param text: js text
+    :param pos: position of the opening bracket
+    :return: list, position after the closing bracket
+        an elided element such as [1,,2] is read as ''
+    """
+    stack, current, expect_value = [], None, True
+    for match in _TOKEN_PATTERN.finditer(text, pos):
+        kind = match.lastindex
+        if kind == 7:
+            if current is None:
+                break
+            if expect_value:
+                current.append('')
+            expect_value = True
+            continue
+        if kind == 6:
+            if current is None:
+                break
+            if not stack:
+                return current, match.end()
+            current = stack.pop()
+            expect_value = False
+            continue
+        if not expect_value or (current is None and kind != 5):
+            break
+
+        if kind == 5:
+            new = []
+            if current is not None:
+                current.append(new)
+                stack.append(current)
+            current = new
+            continue
+        elif kind == 1:
+            current.append(int(match.group(1)))
+        elif kind == 2:
+            current.append(float(match.group(2)))
+        elif kind == 3 or kind == 4:
+            current.append(_string(match.group(kind)))
+        elif kind == 8:
+            current.append(_WORD_VALUE[match.group(8)])
+        else:
+            break
+        expect_value = False
+    else:
+        raise QtwParseError("unterminated array at {0}".format(pos))
+
+    raise QtwParseError("unexpected token at {0}: {1!r}".format(
+        match.start(), text[match.start():match.start() + 20].strip()))
+
+
+def skip_array(text: str, pos: int = 0) -> int:
+    """
+    position after the array literal opening at pos, without building it
+    """
+    depth = 0
+    for match in _SKIP_PATTERN.finditer(text, pos):
+        bracket = match.group(1)
+        if bracket == '[':
+            depth += 1
+        elif bracket == ']':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    raise QtwParseError("unterminated array at {0}".format(pos))
+
+
+def _match_record(row: list) -> MatchRecord:
+    row = list(row[:len(MatchRecord._fields)])
+    row += [''] * (len(MatchRecord._fields) - len(row))
+    return MatchRecord(*row)
+
+
+def iter_rounds(text: str,
+                skip: typing.Callable[[int], bool] = None) -> typing.Iterator[
+        typing.Tuple[int, str, typing.List[MatchRecord]]]:
+    """
+    yield the game weeks of the season payload in page order
+    :param text: season js payload
+    :param skip: skip(game_week) is True --> the round is not parsed and
+        not yielded
+    :return: (game_week, key such as 'R_1', [MatchRecord, ...])
+    """
+    game_week = 0
+    pos = 0
+    while True:
+        match = _ROUND_PATTERN.search(text, pos)
+        if match is None:
+            return
+        game_week += 1
+        if skip is not None and skip(game_week):
+            pos = skip_array(text, match.end())
+            continue
+        rows, pos = parse_array(text, match.end())
+        yield game_week, match.group('key'), [
+            _match_record(row) for row in rows if isinstance(row, list)]
+
+
+def parse_teams(text: str) -> typing.List[TeamRecord]:
+    """read the arrTeam array of the season payload"""
+    match = _TEAM_PATTERN.search(text)
+    if match is None:
+        raise QtwParseError("arrTeam not found")
+    rows, _ = parse_array(text, match.end())
+
+    team_lst = []
+    for row in rows:
+        row = list(row[:len(TeamRecord._fields)])
+        row += [''] * (len(TeamRecord._fields) - len(row))
+        team_lst.append(TeamRecord(*row))
+
+    return team_lst
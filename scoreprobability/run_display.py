@@ -6,22 +6,144 @@
 @Desc      : project command line run entry
 """
 
+import contextlib
+import io
 import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import fire
 import loguru
 import warnings
+from pymongo import MongoClient
 
 from base import SUPPORT_LEAGUE_NAME_ID, get_time, connect_mongodb
-from crawl import save_match_info_to_mongodb, save_team_info_to_mongodb
+from crawl import load_season_payload, save_match_info_to_mongodb
+from crawl import save_team_info_to_mongodb
 from display import league_display
+from schema import ensure_indexes
 from score_predict import run_predict
+from transport import DEFAULT_ARCHIVE_DIR, set_transport, transport_options
 
 logger = loguru.logger
 warnings.filterwarnings('ignore')
 
+# log lines of the league a worker process is running
+_LEAGUE_LOG_LINES = []
+_LEAGUE_LOG_SINK_ADDED = False
+
+
+def run_league(db_client: MongoClient, name: str, start_time: str,
+               end_time: str, model_options: dict, incremental: bool = False):
+    """crawl, fit, predict and display a single league"""
+
+    # season page, downloaded once for team and match information
+    payload = load_season_payload(name)
+
+    # first step
+    # update team information
+    logger.info(
+        "Now start update {0} team info !!!".format(name))
+    save_team_info_to_mongodb(db_client=db_client, league_name=name,
+                              payload=payload)
+    logger.info(
+        "{0} team info have update finished !!!".format(name))
+
+    # second step
+    # update match information
+    logger.info(
+        "Now start update {0} match info !!!".format(name))
+    save_match_info_to_mongodb(db_client=db_client, league_name=name,
+                               payload=payload, incremental=incremental)
+    logger.info(
+        "{0} match info have update finished !!!".format(name))
+
+    # third step
+    # start model predict
+    logger.info("Now start gauss model predict !!!")
+    run_predict(db_client=db_client, league_name=name,
+                start_time=start_time, end_time=end_time, **model_options)
+    logger.info("Model predict have finished !!!")
+
+    # fourth step
+    # display model predict result
+    logger.info("Now start model result display !!!")
+    league_display(db_client=db_client, league_name=name,
+                   start_time=start_time, end_time=end_time)
+    logger.info("Model result display have finished !!!")
+
+
+def _run_league_worker(name: str, start_time: str, end_time: str,
+                       model_options: dict, http_options: dict,
+                       incremental: bool = False):
+    """
+    run a league in a worker process with its own mongodb client
+    :return: name, display output, log lines, seconds, error message
+    """
+    set_transport(**http_options)
+
+    global _LEAGUE_LOG_SINK_ADDED
+    if not _LEAGUE_LOG_SINK_ADDED:
+        logger.add(_LEAGUE_LOG_LINES.append)
+        _LEAGUE_LOG_SINK_ADDED = True
+    del _LEAGUE_LOG_LINES[:]
+
+    start, error = time.time(), None
+    display_output = io.StringIO()
+    db_client = connect_mongodb()
+    try:
+        with contextlib.redirect_stdout(display_output):
+            run_league(db_client, name, start_time, end_time, model_options,
+                       incremental)
+    except Exception as e:
+        logger.exception(e)
+        error = repr(e)
+    finally:
+        db_client.close()
+
+    return name, display_output.getvalue(), "".join(_LEAGUE_LOG_LINES), \
+        time.time() - start, error
+
+
+def run_parallel(league_name_lst: list, start_time: str, end_time: str,
+                 model_options: dict, workers: int,
+                 incremental: bool = False):
+    """run independent leagues in a process pool"""
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_run_league_worker, name, start_time, end_time,
+                            model_options, transport_options(), incremental)
+            for name in league_name_lst]
+        for finished, future in enumerate(as_completed(futures), 1):
+            name, display_output, log_text, seconds, error = future.result()
+            results[name] = display_output
+            logger.info("[{0}/{1}] {2} {3} in {4:.1f}s".format(
+                finished, len(futures), name,
+                "failure: {0}".format(error) if error else "finished",
+                seconds))
+
+            # per league log
+            dir_file = 'output/{0}/'.format(name)
+            if not os.path.exists(dir_file):
+                os.makedirs(dir_file)
+            with open(os.path.join(dir_file, "gauss_predict.log"), "w",
+                      encoding="utf-8") as f:
+                f.write(log_text)
+
+    # display in league order
+    for name in league_name_lst:
+        print(results[name], end="")
+
 
-def main(league_name: str, start_time: str, end_time: str):
+def main(league_name: str, start_time: str, end_time: str,
+         refit: bool = False, engine: str = 'mcmc',
+         predictive: str = 'plugin', draws: int = 200, workers: int = 1,
+         transport: str = 'live', archive_dir: str = DEFAULT_ARCHIVE_DIR,
+         incremental: bool = False, data_source: str = 'database',
+         chains: int = 1, model: str = 'poisson', joint_leagues=None):
     """
     predict the prob of the number of goals scored by the home and away team by
     gauss model
@@ -30,51 +152,58 @@ def main(league_name: str, start_time: str, end_time: str):
         for example: "dj", "yc", "xj", "yj", "fj"
     :param start_time: 20181218
     :param end_time: 20181220
+    :param refit: ignore the cached posterior and run the sampler again
+    :param engine: "mcmc" --> pymc sampler, "mle" --> fast scipy fit
+    :param predictive: "plugin" --> poisson of the posterior mean params,
+        "posterior" --> average over thinned posterior draws
+    :param draws: max posterior draws of the "posterior" mode
+    :param workers: number of leagues run in parallel processes, each league
+        log goes to output/<league>/gauss_predict.log
+    :param transport: "live", "record" --> also archive the qtw responses,
+        "replay" --> crawl from the archive only, no network
+    :param archive_dir: directory of the recorded qtw responses
+    :param incremental: only crawl the rounds which can still change, from
+        the per league watermark of the last run
+    :param data_source: "database" --> played data from mongodb, "snapshot"
+        --> feather snapshot of the played data refreshed from mongodb
+    :param chains: mcmc chains of a league run in parallel processes, their
+        R-hat and effective sample size are logged
+    :param model: "poisson" --> independent home and away goals,
+        "dixon_coles" --> rho corrected 0:0, 1:0, 0:1 and 1:1
+    :param joint_leagues: leagues fitted jointly with every league, such as
+        "yc,xj", for the cup and european matches between their teams
     :return: 310, dxq, yp over and under odd result
     """
 
-    db_client = connect_mongodb()
+    model_options = {'refit': refit, 'engine': engine,
+                     'predictive': predictive, 'draws': draws,
+                     'data_source': data_source, 'chains': chains,
+                     'model': model, 'joint_leagues': joint_leagues}
+
     start_time, end_time = get_time(start_time, end_time)
+    set_transport(transport, archive_dir)
 
     if league_name == "all":
         league_name_lst = list(SUPPORT_LEAGUE_NAME_ID.keys())
     else:
         league_name_lst = [league_name]
 
-    for name in league_name_lst:
-        # first step
-        # update team information
-        logger.info(
-            "Now start update {0} team info !!!".format(name))
-        save_team_info_to_mongodb(db_client=db_client, league_name=name)
-        logger.info(
-            "{0} team info have update finished !!!".format(name))
-
-        # second step
-        # update match information
-        logger.info(
-            "Now start update {0} match info !!!".format(name))
-        save_match_info_to_mongodb(db_client=db_client, league_name=name)
-        logger.info(
-            "{0} match info have update finished !!!".format(name))
-
-        # third step
-        # start model predict
-        logger.info("Now start gauss model predict !!!")
-        run_predict(db_client=db_client, league_name=name,
-                    start_time=start_time, end_time=end_time)
-        logger.info("Model predict have finished !!!")
-
-        # fourth step
-        # display model predict result
-        logger.info("Now start model result display !!!")
-        league_display(db_client=db_client, league_name=name,
-                       start_time=start_time, end_time=end_time)
-        logger.info("Model result display have finished !!!")
-
-        # fifth step
+    db_client = connect_mongodb()
+    ensure_indexes(db_client)
+
+    if workers > 1 and len(league_name_lst) > 1:
         db_client.close()
-        logger.info("Mongodb client have closed !!!")
+        run_parallel(league_name_lst, start_time, end_time, model_options,
+                     workers, incremental)
+        return
+
+    for name in league_name_lst:
+        run_league(db_client, name, start_time, end_time, model_options,
+                   incremental)
+
+    # fifth step
+    db_client.close()
+    logger.info("Mongodb client have closed !!!")
 
 
 if __name__ == "__main__":
@@ -85,4 +214,10 @@ if __name__ == "__main__":
 
     # python3 gauss_run_display.py --league_name dj
     # --start_time 20181218 --end_time 20181220 > gauss_predict_dj.txt
+    # python3 run_display.py --league_name all --workers 8
+    # --start_time 20181218 --end_time 20181220 > gauss_predict.txt
+    # python3 run_display.py --league_name dj --transport replay
+    # --archive_dir fixtures/ --start_time 20181218 --end_time 20181220
+    # python3 run_display.py --league_name all --incremental
+    # --start_time 20181218 --end_time 20181220 > gauss_predict.txt
     fire.Fire(main)
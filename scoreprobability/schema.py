@@ -0,0 +1,164 @@
+"""
+@Project   : ScoreProbability
+@Module    : schema.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 6:30 PM
+@Desc      : indexes of the xscore collections and explain plan checks of the
+             hot queries
+"""
+
+import typing
+
+import fire
+import loguru
+from pymongo import ASCENDING, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+from base import SUPPORT_LEAGUE_NAME_ID, connect_mongodb
+
+logger = loguru.logger
+
+XSCORE_INDEXES = {
+    "match_info": [
+        IndexModel([("qtw_match_id", ASCENDING)], unique=True,
+                   name="qtw_match_id_unique"),
+        # get_played_data, get_fixture_data: equality, $in, then range
+        IndexModel([("qtw_league_id", ASCENDING), ("status", ASCENDING),
+                    ("match_time", ASCENDING)],
+                   name="league_status_match_time"),
+    ],
+    "team_info": [
+        IndexModel([("league_id", ASCENDING), ("team_id", ASCENDING)],
+                   unique=True, name="league_team_unique"),
+    ],
+    "league_info": [
+        IndexModel([("league_id", ASCENDING)], unique=True,
+                   name="league_id_unique"),
+    ],
+    "model_gauss": [
+        IndexModel([("qtw_match_id", ASCENDING)], unique=True,
+                   name="qtw_match_id_unique"),
+    ],
+    "crawl_state": [
+        IndexModel([("league_name", ASCENDING)], unique=True,
+                   name="league_name_unique"),
+    ],
+}
+
+
+def ensure_indexes(db_client: MongoClient) -> typing.Dict[str, list]:
+    """
+    create the missing indexes of the xscore collections, existing indexes
+    are left as they are
+    :param db_client: mongodb client
+    :return: {collection: [index name, ...]} of the created or existing
+        indexes, a collection whose index build failed is logged and left out
+    """
+    result = {}
+    for collection, indexes in XSCORE_INDEXES.items():
+        tb = db_client["xscore"][collection]
+        try:
+            result[collection] = tb.create_indexes(indexes)
+        except OperationFailure as e:
+            # such as duplicate keys of a unique index on existing docs
+            logger.error("index of xscore.{0} failure: {1}".format(
+                collection, e))
+    logger.info("xscore indexes: {0}".format(result))
+    return result
+
+
+def hot_queries(qtw_league_id: int) -> typing.List[
+        typing.Tuple[str, str, dict]]:
+    """(name, collection, filter) of the queries run for every league"""
+    return [
+        ("get_played_data", "match_info",
+         {"qtw_league_id": qtw_league_id, "status": 2}),
+        ("get_fixture_data", "match_info",
+         {"qtw_league_id": qtw_league_id,
+          "match_time": {"$lt": "2099-01-01 00:00:00",
+                         "$gt": "2000-01-01 00:00:00"},
+          "status": {"$in": [1, 3]}}),
+        ("refresh_snapshot", "match_info",
+         {"qtw_league_id": qtw_league_id, "status": 2,
+          "match_time": {"$gte": "2000-01-01 00:00:00"}}),
+        ("bulk_save_match_info", "match_info",
+         {"qtw_match_id": {"$in": [0]}}),
+        ("team_id_name_by_league_id", "team_info",
+         {"league_id": qtw_league_id}),
+        ("save_team_info_to_mongodb", "team_info",
+         {"league_id": qtw_league_id, "team_id": 0}),
+        ("load_slate", "model_gauss", {"qtw_match_id": {"$in": [0]}}),
+        ("run_predict", "model_gauss", {"qtw_match_id": 0}),
+        ("get_crawl_state", "crawl_state", {"league_name": ""}),
+    ]
+
+
+def plan_stages(plan: dict) -> typing.List[str]:
+    """stage names of a query plan tree"""
+    stages = [plan.get("stage")]
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = children + [plan["inputStage"]]
+    for child in children:
+        stages.extend(plan_stages(child))
+    return stages
+
+
+def explain_queries(db_client: MongoClient,
+                    qtw_league_id: int) -> typing.List[dict]:
+    """
+    winning plan of every hot query
+    :return: [{name, collection, stages, collscan}, ...]
+    """
+    report = []
+    for name, collection, query in hot_queries(qtw_league_id):
+        explain = db_client["xscore"][collection].find(query).explain()
+        stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+        report.append({
+            "name": name,
+            "collection": collection,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return report
+
+
+def ensure():
+    """create the missing indexes of the xscore collections"""
+    db_client = connect_mongodb()
+    try:
+        ensure_indexes(db_client)
+    finally:
+        db_client.close()
+
+
+def explain(league_name: str = "yc"):
+    """
+    print the winning plan of every hot query, collection scans are flagged
+    :param league_name: league whose ids are used in the queries
+    """
+    db_client = connect_mongodb()
+    try:
+        report = explain_queries(
+            db_client, int(SUPPORT_LEAGUE_NAME_ID[league_name]))
+    finally:
+        db_client.close()
+
+    for row in report:
+        print("{0:<28}{1:<14}{2:<10}{3}".format(
+            row["name"], row["collection"],
+            "COLLSCAN" if row["collscan"] else "ok",
+            " <- ".join(row["stages"])))
+
+    collscan = [row["name"] for row in report if row["collscan"]]
+    if collscan:
+        logger.error("collection scan of {0}, run: python3 schema.py "
+                     "ensure".format(collscan))
+    else:
+        logger.info("every hot query uses an index")
+
+
+if __name__ == "__main__":
+    # python3 schema.py ensure
+    # python3 schema.py explain --league_name dj
+    fire.Fire({"ensure": ensure, "explain": explain})
@@ -6,9 +6,12 @@
 @Desc      : predict the outcome by score probability calculation model
 """
 
+import collections
 import logging
 import os
+import time
 import typing
+from concurrent.futures import ProcessPoolExecutor
 
 import loguru
 import numpy as np
@@ -17,27 +20,373 @@ import pymc
 from pymongo import MongoClient
 from scipy.stats import poisson
 
-from base import SUPPORT_LEAGUE_ID_LIST, team_id_en_name_by_league_id
+from base import SUPPORT_LEAGUE_ID_LIST, TeamIndex
+from base import team_id_en_name_by_league_id
 from base import SUPPORT_LEAGUE_ID_NAME, SUPPORT_LEAGUE_NAME_ID
-from base import get_fixture_data, get_played_data
+from base import get_fixture_data, get_played_data, join_played_data
+from diagnostics import PARAM_NAMES, RHAT_MAX, converged
+from diagnostics import trace_summary
+from likelihood import DEFAULT_HALF_LIFE, MODEL_LST, RHO_BOUNDS, fit_mle
+from likelihood import LEAGUE_PRIOR_TAU, league_scaled, team_leagues
+from likelihood import dixon_coles_log_likelihood, poisson_log_likelihood
+from likelihood import fit_config, time_weights, trim_played_data
+from likelihood import window_days
+from posterior_cache import PosteriorCache
+from score_store import encode_score
+from snapshot import load_snapshot, refresh_snapshot
 
 logger = loguru.logger
 
+# "mcmc": pymc sampler, "mle": scipy maximum a posteriori fit
+ENGINE_LST = ['mcmc', 'mle']
+
+# "plugin": poisson of the posterior mean params,
+# "posterior": average of the poisson over thinned posterior draws
+PREDICTIVE_LST = ['plugin', 'posterior']
+POSTERIOR_DRAWS = 200
+
+# pymc sampler settings, part of the posterior cache key
+# burn, block --> cold start burn-in and iterations per block, warm_burn,
+# warm_block --> the same when started from the last posterior of the
+# league, blocks are added until the R-hat and effective sample size targets
+# are met or max_iter is reached, chains --> independent chains run in
+# parallel processes
+# ESS_TARGET --> half the draws the predictor averages at most, the monte
+# carlo error of a posterior mean is then a tenth of the posterior sd,
+# max_iter is the fixed run length of the former sampler, so a run is never
+# longer
+ESS_TARGET = POSTERIOR_DRAWS // 2
+SAMPLER_SETTINGS = {
+    'burn': 100, 'warm_burn': 20, 'block': 1000, 'warm_block': 500,
+    'max_iter': 5000, 'thin': 5, 'rhat_max': RHAT_MAX,
+    'ess_min': ESS_TARGET, 'chains': 1
+}
+
+# iterations of the adaptive metropolis step before its proposal covariance
+# is first estimated from the chain
+ADAPTIVE_DELAY = 200
+
+# score matrix covers 0 .. GOAL_LIMIT - 1 goals of each team
+GOAL_LIMIT = 11
+
+
+def dixon_coles_adjust(matrices: np.ndarray, home_strength, away_strength,
+                       rho) -> np.ndarray:
+    """
+    rho correction of the 0:0, 1:0, 0:1 and 1:1 cells of a batch of score
+    matrices, in place, the matrix sums are unchanged
+    :param matrices: (n_matches, k, k) independent poisson score matrices
+    :param home_strength: home scoring strength of every match
+    :param away_strength: away scoring strength of every match
+    :param rho: low score dependence, a scalar or one per match
+    """
+    lam = np.asarray(home_strength, dtype=float).ravel()
+    mu = np.asarray(away_strength, dtype=float).ravel()
+    rho = np.asarray(rho, dtype=float).ravel()
+
+    matrices[:, 0, 0] *= np.maximum(1 - lam * mu * rho, 0)
+    matrices[:, 0, 1] *= np.maximum(1 + lam * rho, 0)
+    matrices[:, 1, 0] *= np.maximum(1 + mu * rho, 0)
+    matrices[:, 1, 1] *= np.maximum(1 - rho, 0)
+    return matrices
+
+
+def score_matrices(home_strength, away_strength,
+                   goal_limit: int = GOAL_LIMIT, rho=None) -> np.ndarray:
+    """
+    score probability matrices of a batch of matches
+    :param home_strength: home scoring strength of every match
+    :param away_strength: away scoring strength of every match
+    :param goal_limit: number of goals covered by each team
+    :param rho: dixon-coles low score dependence, a scalar or one per match,
+        None --> independent poisson
+    :return: (n_matches, goal_limit, goal_limit) array,
+        [m, i, j] = prob of home team scores i and away team scores j
+    """
+    goals = np.arange(goal_limit)
+    home_pmf = poisson.pmf(
+        goals, np.asarray(home_strength, dtype=float).reshape(-1, 1))
+    away_pmf = poisson.pmf(
+        goals, np.asarray(away_strength, dtype=float).reshape(-1, 1))
+
+    matrices = home_pmf[:, :, np.newaxis] * away_pmf[:, np.newaxis, :]
+    if rho is not None:
+        dixon_coles_adjust(matrices, home_strength, away_strength, rho)
+    return matrices
+
+
+def score_matrix(home_strength: float, away_strength: float,
+                 goal_limit: int = GOAL_LIMIT, rho=None) -> np.ndarray:
+    """score probability matrix of a single match"""
+    if rho is not None:
+        return score_matrices([home_strength], [away_strength], goal_limit,
+                              rho)[0]
+    goals = np.arange(goal_limit)
+    return np.outer(poisson.pmf(goals, home_strength),
+                    poisson.pmf(goals, away_strength))
+
+
+def initial_values(teams: typing.List[str], prev_teams: typing.List[str],
+                   prev_traces: typing.Dict[str, np.ndarray]
+                   ) -> typing.Tuple[np.ndarray, np.ndarray, float]:
+    """
+    start values of the sampler from a former posterior of the league
+    :param teams: teams of the new fit
+    :param prev_teams: teams of the former posterior
+    :param prev_traces: traces of the former posterior
+    :return: alpha, beta, lambda_value, 1 for a team new to the league
+    """
+    prev_code = dict(zip(prev_teams, range(len(prev_teams))))
+    alpha_mean = np.asarray(prev_traces['alpha']).mean(axis=0)
+    beta_mean = np.asarray(prev_traces['beta']).mean(axis=0)
+
+    alpha, beta = np.ones(len(teams)), np.ones(len(teams))
+    for code, team in enumerate(teams):
+        if team in prev_code:
+            alpha[code] = alpha_mean[prev_code[team]]
+            beta[code] = beta_mean[prev_code[team]]
+
+    return alpha, beta, float(np.mean(prev_traces['lambda_value']))
+
+
+def model_traces(model) -> typing.Dict[str, np.ndarray]:
+    """traces of the last sample call of a pymc model"""
+    sampled = set(node.__name__ for node in model.stochastics)
+    return {name: np.asarray(model.trace(name)[:])
+            for name in PARAM_NAMES if name in sampled}
+
+
+def adaptive_sample(model, teams: typing.List[str], burn: int = 100,
+                    thin: int = 5, block: int = 1000,
+                    max_iter: int = 5000, rhat_max: float = RHAT_MAX,
+                    ess_min: float = ESS_TARGET
+                    ) -> typing.Dict[str, np.ndarray]:
+    """
+    sample a pymc model block by block until the kept draws converge
+    :param model: pymc.MCMC
+    :param teams: team of every column of alpha and beta
+    :param burn: iterations dropped before the first block
+    :param thin: thinning of every block
+    :param block: iterations added while the targets are not met, when
+        R-hat fails the first half of all draws becomes extra burn-in
+    :param max_iter: iterations after which the draws are kept anyway
+    :param rhat_max: max split R-hat of every param
+    :param ess_min: min effective sample size of every param
+    :return: traces of the kept draws
+    """
+    model.sample(iter=burn + block, burn=burn, thin=thin, verbose=False,
+                 progress_bar=False)
+    total_iter = burn + block
+    draws = model_traces(model)
+    start = 0
+
+    while True:
+        traces = {name: values[start:] for name, values in draws.items()}
+        summary = trace_summary([traces], teams)
+        logger.info("{0} iterations, {1} draws kept, max R-hat {2:.3f}, "
+                    "min ess {3:.0f}".format(
+                        total_iter, len(traces['lambda_value']),
+                        summary['rhat'].max(), summary['ess'].min()))
+        if converged(summary, ess_min, rhat_max):
+            break
+        if total_iter >= max_iter:
+            logger.warning("sampler stopped at max_iter = {0} before "
+                           "convergence".format(max_iter))
+            break
+
+        if (summary['rhat'] > rhat_max).any():
+            start = max(start, len(draws['lambda_value']) // 2)
+
+        model.sample(iter=block, burn=0, thin=thin, verbose=False,
+                     progress_bar=False)
+        total_iter += block
+        block_draws = model_traces(model)
+        draws = {name: np.concatenate([draws[name], block_draws[name]])
+                 for name in draws}
+
+    return traces
+
+
+def posterior_sampler(data: pd.DataFrame,
+                      start: typing.Tuple[np.ndarray, np.ndarray, float],
+                      half_life: float = DEFAULT_HALF_LIFE,
+                      weights: np.ndarray = None, model: str = 'poisson'):
+    """
+    pymc model of the played data
+    :param data: played data --> Date, HomeTeam, AwayTeam, FTHG, FTAG
+    :param start: start values of alpha, beta and lambda_value
+    :param half_life: time weighting half life of the likelihood in days
+    :param weights: time weights of the data, None --> time_weights
+    :param model: "poisson" or "dixon_coles" --> also samples rho, uniform
+        prior over RHO_BOUNDS starting at 0
+    :return: pymc.MCMC, teams of the alpha and beta columns, joint played
+        data with a League column also samples log_strength, normal prior
+        starting at 0
+    """
+    # setting hyper-parameters: a_i, b_i, c_i, d_i, g, h
+    # N = 20 --> number of teams
+    team_index = TeamIndex.from_data(data)
+    n = len(team_index)
+    ab_hyper, cd_hyper = (1, 1), (1, 1)
+    g, h = 1, 1
+    alpha_init, beta_init, lambda_init = start
+
+    # prior for alpha_i, attack
+    alpha = pymc.Gamma(name='alpha', alpha=ab_hyper[0], beta=ab_hyper[1],
+                       value=alpha_init, size=n, doc='attack')
+
+    # prior for beta_i, defence
+    beta = pymc.Gamma(name='beta', alpha=cd_hyper[0], beta=cd_hyper[1],
+                      value=beta_init, size=n, doc='defence')
+
+    # prior for lambda_value --> default: exists home advantage
+    lambda_value = pymc.Gamma(
+        name='lambda_value', alpha=g, beta=h, value=lambda_init,
+        doc='home advantage')
+
+    """
+    alpha_i * beta_j * lambda_value, beta_i * alpha_j, 
+    for each match in the dataset
+    """
+    # home team index
+    i_s = team_index.codes(data.HomeTeam)
+    # away team index
+    j_s = team_index.codes(data.AwayTeam)
+
+    home_goals = data.FTHG.values.astype(float)
+    away_goals = data.FTAG.values.astype(float)
+    time_weighting = time_weights(data['Date'], half_life) \
+        if weights is None else weights
+
+    parents = {'alpha': alpha, 'beta': beta, 'lambda_value': lambda_value}
+    nodes = [alpha, beta, lambda_value]
+
+    if model == 'dixon_coles':
+        # prior for rho --> dependence of the low scores
+        parents['rho'] = pymc.Uniform(
+            name='rho', lower=RHO_BOUNDS[0], upper=RHO_BOUNDS[1], value=0.0,
+            doc='low score dependence')
+        nodes.append(parents['rho'])
+
+    home_league, away_league = None, None
+    if 'League' in data.columns:
+        # prior for the log strength of every league but the reference
+        leagues, team_league = team_leagues(data, team_index.teams)
+        home_league, away_league = team_league[i_s], team_league[j_s]
+        if len(leagues) > 1:
+            parents['log_strength'] = pymc.Normal(
+                name='log_strength', mu=0, tau=LEAGUE_PRIOR_TAU,
+                value=np.zeros(len(leagues) - 1), size=len(leagues) - 1,
+                doc='league strength')
+            nodes.append(parents['log_strength'])
+
+    # time weighted likelihood, one vectorized evaluation per step
+    def log_likelihood(alpha, beta, lambda_value, rho=None,
+                       log_strength=None):
+        home_rate = alpha[i_s] * beta[j_s] * lambda_value
+        away_rate = beta[i_s] * alpha[j_s]
+        if log_strength is not None:
+            strength = np.exp(np.concatenate([[0.0], log_strength]))
+            ratio = strength[home_league] / strength[away_league]
+            home_rate, away_rate = home_rate * ratio, away_rate / ratio
+        if rho is not None:
+            return dixon_coles_log_likelihood(
+                home_rate, away_rate, home_goals, away_goals,
+                time_weighting, rho)
+        return poisson_log_likelihood(
+            home_rate, away_rate, home_goals, away_goals, time_weighting)
+
+    likelihood = pymc.Potential(
+        logp=log_likelihood, name='likelihood', parents=parents,
+        doc='time weighted likelihood')
+
+    # wrap the model
+    model = pymc.MCMC([likelihood] + nodes)
+
+    # only products of the params enter the rates, so they are strongly
+    # correlated: one adaptive metropolis step learns their joint proposal
+    # covariance, the default step of a vector node is a single random
+    # walk accepted or rejected for all the teams at once
+    model.use_step_method(pymc.AdaptiveMetropolis, nodes,
+                          delay=ADAPTIVE_DELAY)
+
+    return model, team_index.teams
+
+
+def sample_chain(data: pd.DataFrame,
+                 start: typing.Tuple[np.ndarray, np.ndarray, float],
+                 seed: int, half_life: float = DEFAULT_HALF_LIFE,
+                 weights: np.ndarray = None, model: str = 'poisson',
+                 **sample_options) -> typing.Dict[str, np.ndarray]:
+    """
+    one chain of the posterior, run in a worker process by sample_posterior
+    :param seed: seed of the numpy random state used by pymc
+    :param sample_options: burn, thin, block, ... of adaptive_sample
+    :return: traces of the chain
+    """
+    np.random.seed(seed)
+    sampler, teams = posterior_sampler(data, start, half_life, weights,
+                                       model)
+    return adaptive_sample(sampler, teams, **sample_options)
+
+
+def disperse_start(start: typing.Tuple[np.ndarray, np.ndarray, float],
+                   random_state: np.random.RandomState, scale: float = 0.5
+                   ) -> typing.Tuple[np.ndarray, np.ndarray, float]:
+    """start values scattered by a lognormal factor around start"""
+    alpha, beta, lambda_value = start
+    return (alpha * np.exp(random_state.normal(0, scale, len(alpha))),
+            beta * np.exp(random_state.normal(0, scale, len(beta))),
+            float(lambda_value * np.exp(random_state.normal(0, scale))))
+
 
 class ScoreProbabilityModel:
     def __init__(self, db_client: MongoClient, data_source='database',
                  league_id=None, league_id2=None, csv=None, csv2=None,
-                 lang='en'):
+                 lang='en', use_cache=True, refit=False, engine='mcmc',
+                 goal_limit=GOAL_LIMIT, predictive='plugin',
+                 draws=POSTERIOR_DRAWS, half_life=None, chains=1,
+                 lookback_days=None, min_weight=None, model='poisson',
+                 joint=False):
         """
         Initialization parameters
         :param db_client: mongodb client
-        :param data_source: 'opta'
+        :param data_source: 'database', 'csv' or 'snapshot' --> feather
+            snapshot of the played data, refreshed from mongodb when
+            db_client is given, read without a database otherwise
         :param league_id: league
-        :param league_id2: league2
+        :param league_id2: league2, or a list of leagues
         :param csv: league match info (Played)
-        :param csv2: league2 match info (Played)
+        :param csv2: league2 match info (Played), or a list of csv
         :param lang: "en" or "cn"
+        :param use_cache: reuse the posterior stored for the same played data
+        :param refit: ignore the stored posterior and run the sampler again
+        :param engine: "mcmc" or "mle"
+        :param goal_limit: score matrix covers 0 .. goal_limit - 1 goals
+        :param predictive: "plugin" or "posterior"
+        :param draws: max posterior draws averaged by the "posterior" mode
+        :param half_life: time weighting half life of the likelihood in days
+        :param chains: mcmc chains run in parallel processes
+        :param lookback_days: max age of the fitted matches in days
+        :param min_weight: matches whose time weight is below it are dropped
+            half_life, lookback_days, min_weight: None --> fit_config of the
+            league
+        :param model: "poisson" --> independent home and away goals,
+            "dixon_coles" --> rho corrected low scores
+        :param joint: fit the union of the played data of league / csv and
+            league_id2 / csv2 with one team index and a strength offset per
+            league, prices the matches between teams of different leagues
         """
+        if engine not in ENGINE_LST:
+            raise ValueError("engine must be in {0}".format(ENGINE_LST))
+        if model not in MODEL_LST:
+            raise ValueError("model must be in {0}".format(MODEL_LST))
+        if joint and league_id2 is None and csv2 is None:
+            raise ValueError("joint fit needs league_id2 or csv2")
+        if predictive not in PREDICTIVE_LST:
+            raise ValueError(
+                "predictive must be in {0}".format(PREDICTIVE_LST))
+
         self.db_client = db_client
         self.data_source = data_source
         self.league_id = league_id
@@ -45,14 +394,46 @@ class ScoreProbabilityModel:
         self.csv = csv
         self.csv2 = csv2
         self.lang = lang
+        self.use_cache = use_cache
+        self.refit = refit
+        self.engine = engine
+        self.goal_limit = goal_limit
+        self.predictive = predictive
+        self.draws = draws
+        config = fit_config(league_id)
+        self.half_life = config['half_life'] if half_life is None \
+            else half_life
+        self.lookback_days = config['lookback_days'] if lookback_days is None \
+            else lookback_days
+        self.min_weight = config['min_weight'] if min_weight is None \
+            else min_weight
+        self.weights = None
+        self.sampler_settings = dict(SAMPLER_SETTINGS, chains=chains)
+        self.model = model
+        self.rho = None
+        self.joint = joint
+        self.other_data = collections.OrderedDict()
+        self.estimated_params = None
+        self.estimated_gamma = None
+        self.teams, self.traces = None, None
+        self.team_index = None
+        self.attack, self.defence, self.home_advantage = None, None, None
 
     def get_data(self):
         """
         get data from database or csv
         """
+        # a new data snapshot invalidates any previous fit
+        self.estimated_params, self.estimated_gamma = None, None
+        self.teams, self.traces = None, None
+
+        days = window_days(self.half_life, self.lookback_days,
+                           self.min_weight)
+
         if self.data_source == 'database':
             if self.league_id2 is None:
-                self.data = get_played_data(self.db_client, self.league_id)
+                self.data = get_played_data(self.db_client, self.league_id,
+                                            last_days=days)
                 logger.info('*' * 100)
                 logger.info('team_A_name comes from: {0}'.format(
                     self.data.HomeTeam.unique()))
@@ -60,14 +441,23 @@ class ScoreProbabilityModel:
                     self.data.AwayTeam.unique()))
                 logger.info('*' * 100)
             elif self.league_id2 is not None:
-                self.data = get_played_data(self.db_client, self.league_id)
-                self.data2 = get_played_data(self.db_client, self.league_id2)
+                self.data = get_played_data(self.db_client, self.league_id,
+                                            last_days=days)
+                self.data2 = self._other_data(
+                    lambda league_id: get_played_data(
+                        self.db_client, league_id, last_days=days))
                 logger.info('*' * 100)
                 logger.info('team_A_name, team_B_name comes from: {0}'.format(
                     self.data.HomeTeam.unique()))
                 logger.info('team_A_name, team_B_name comes from: {0}'.format(
                     self.data2.AwayTeam.unique()))
                 logger.info('*' * 100)
+        elif self.data_source == 'snapshot':
+            self.data = self._snapshot_data(self.league_id)
+            if self.league_id2 is not None:
+                self.data2 = self._other_data(self._snapshot_data)
+            logger.info('team_A_name, team_B_name comes from: {0}'.format(
+                self.data.HomeTeam.unique()))
         elif self.data_source == 'csv':
             if self.csv2 is None:
                 self.data = pd.read_csv(self.csv)
@@ -79,7 +469,7 @@ class ScoreProbabilityModel:
                 logger.info('*' * 100)
             elif self.csv2 is not None:
                 self.data = pd.read_csv(self.csv)
-                self.data2 = pd.read_csv(self.csv2)
+                self.data2 = self._other_data(pd.read_csv)
                 logger.info('*' * 100)
                 logger.info('team_A_name, team_B_name comes from: {0}'.format(
                     self.data.HomeTeam.unique()))
@@ -87,99 +477,177 @@ class ScoreProbabilityModel:
                     self.data2.AwayTeam.unique()))
                 logger.info('*' * 100)
 
+        if self.joint:
+            frames = collections.OrderedDict([(
+                self.csv if self.data_source == 'csv' else self.league_id,
+                self.data)])
+            frames.update(self.other_data)
+            self.data = join_played_data(frames)
+            logger.info("joint fit of {0}".format(list(frames.keys())))
+            self._check_shared_teams()
+
+        # matches of negligible weight never reach the fit
+        played = len(self.data)
+        self.data = trim_played_data(self.data, days)
+        if getattr(self, 'data2', None) is not None:
+            self.data2 = trim_played_data(self.data2, days)
+        logger.info("{0} of {1} played matches within {2:.0f} days".format(
+            len(self.data), played, days))
+
+        # weights of the snapshot, shared by every fit of the model
+        self.weights = time_weights(self.data['Date'], self.half_life)
+
+    def other_leagues(self) -> list:
+        """league_id2 or csv2 as a list, None --> []"""
+        other = self.csv2 if self.data_source == 'csv' else self.league_id2
+        if other is None:
+            return []
+        if isinstance(other, (list, tuple)):
+            return list(other)
+        return [other]
+
+    def _other_data(self, load: typing.Callable) -> pd.DataFrame:
+        """
+        played data of league_id2 or csv2, several leagues are concatenated
+        :param load: played data of a single league_id or csv
+        """
+        self.other_data = collections.OrderedDict(
+            (league, load(league)) for league in self.other_leagues())
+        return pd.concat(list(self.other_data.values()), ignore_index=True)
+
+    def _check_shared_teams(self):
+        """
+        teams in the played data of several leagues of the union are fitted
+        as one team, right for team ids, a guess for the team names of csv
+        """
+        home = self.data[['HomeTeam', 'League']]
+        away = self.data[['AwayTeam', 'League']].rename(
+            columns={'AwayTeam': 'HomeTeam'})
+        leagues = pd.concat([home, away]).drop_duplicates()
+        counts = leagues.HomeTeam.value_counts()
+        shared = sorted(counts[counts > 1].index.tolist())
+        if not shared:
+            return
+        if self.data_source == 'csv':
+            logger.warning("teams named alike in several leagues are merged "
+                           "into one team: {0}".format(shared))
+        else:
+            logger.info("teams in several leagues: {0}".format(shared))
+
+    def _snapshot_data(self, league_id: int) -> pd.DataFrame:
+        if self.db_client is not None:
+            return refresh_snapshot(self.db_client, league_id)
+        return load_snapshot(league_id)
+
     @staticmethod
-    def build_model(data: pd.DataFrame):
-        data['Date'] = [pd.to_datetime(date) for date in data['Date']]
-        # setting hyper-parameters: a_i, b_i, c_i, d_i, g, h
-        # N = 20 --> number of teams
-        teams = sorted(data.HomeTeam.unique())
+    def sample_posterior(data: pd.DataFrame, burn=100, thin=5,
+                         half_life=DEFAULT_HALF_LIFE, initial=None,
+                         warm_burn=20, block=1000, warm_block=500,
+                         max_iter=5000, rhat_max=RHAT_MAX,
+                         ess_min=ESS_TARGET, chains=1, seed=None,
+                         weights=None, model='poisson'):
+        """
+        run the pymc sampler on the played data
+        :param half_life: time weighting half life of the likelihood in days
+        :param initial: (teams, traces) of a former posterior of the league,
+            the chains start around its means with warm_burn burn-in and
+            blocks of warm_block iterations
+        :param burn, thin, block, max_iter, rhat_max: adaptive_sample
+        :param ess_min: min effective sample size of the merged chains
+        :param chains: independent chains run in parallel processes, with
+            their own seeds and dispersed starts
+        :param seed: seed of the chain seeds, None --> random
+        :param weights: time weights of the data, None --> time_weights
+        :param model: "poisson" or "dixon_coles"
+        :return: teams, traces --> {'alpha': (draws, teams),
+            'beta': (draws, teams), 'lambda_value': (draws, )}, plus
+            'rho': (draws, ) of dixon_coles, the draws of every chain one
+            after another
+        """
+        teams = TeamIndex.from_data(data).teams
         n = len(teams)
-        ab_hyper, cd_hyper = [(1, 1)] * n, [(1, 1)] * n
-        g, h = 1, 1
-
-        # prior for alpha_i, attack
-        alpha_1 = pymc.Gamma(name='alpha_1', alpha=ab_hyper[0][0],
-                             beta=ab_hyper[0][1], doc=teams[0] + '(attack)')
-        alpha = np.empty(n, dtype=object)
-        alpha[0] = alpha_1
-        for i in range(1, n):
-            alpha[i] = pymc.Gamma(
-                name='alpha_%i' % (i + 1), alpha=ab_hyper[i][0],
-                beta=ab_hyper[i][1], doc=teams[i] + '(attack)')
-
-        # prior for beta_i, defence
-        beta_1 = pymc.Gamma(
-            name='beta_1', alpha=cd_hyper[0][0], beta=cd_hyper[0][1],
-            doc=teams[0] + '(defence)')
-        beta = np.empty(n, dtype=object)
-        beta[0] = beta_1
-        for i in range(1, n):
-            beta[i] = pymc.Gamma(
-                name='beta_%i' % (i + 1), alpha=cd_hyper[i][0],
-                beta=cd_hyper[i][1], doc=teams[i] + '(defence)')
-
-        # prior for lambda_value --> default: exists home advantage
-        lambda_value = pymc.Gamma(
-            name='lambda_value', alpha=g, beta=h, doc='home advantage')
 
+        if initial is not None:
+            start = initial_values(teams, *initial)
+            burn, block = warm_burn, warm_block
+            logger.info("sampler warm started from the last posterior")
+        else:
+            start = (np.ones(n), np.ones(n), 1.0)
+
+        random_state = np.random.RandomState(seed)
+        seeds = random_state.randint(0, 2 ** 31 - 1, size=chains)
+        starts = [start] + [disperse_start(start, random_state)
+                            for _ in range(chains - 1)]
+        options = {
+            'half_life': half_life, 'weights': weights, 'model': model,
+            'burn': burn,
+            'thin': thin, 'block': block, 'max_iter': max_iter,
+            'rhat_max': rhat_max,
+            'ess_min': int(np.ceil(float(ess_min) / chains))
+        }
+
+        start_time = time.time()
+        if chains == 1:
+            chain_traces = [sample_chain(data, starts[0], seeds[0], **options)]
+        else:
+            workers = min(chains, os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(sample_chain, data, chain_start,
+                                    chain_seed, **options)
+                    for chain_start, chain_seed in zip(starts, seeds)]
+                chain_traces = [future.result() for future in futures]
+        seconds = time.time() - start_time
+
+        summary = trace_summary(chain_traces, teams)
+        logger.info("{0} chains in {1:.1f}s, max R-hat {2:.3f}, min ess "
+                    "{3:.0f}, {4:.1f} effective draws per second\n{5}".format(
+                        chains, seconds, summary['rhat'].max(),
+                        summary['ess'].min(),
+                        summary['ess'].min() / max(seconds, 1e-9),
+                        summary.to_string()))
+        if not converged(summary, ess_min, rhat_max):
+            logger.warning("posterior has not converged, see R-hat and ess")
+
+        traces = {name: np.concatenate([chain[name] for chain in chain_traces])
+                  for name in chain_traces[0]}
+        return teams, traces
+
+    @staticmethod
+    def estimate_params(teams: typing.List[str],
+                        traces: typing.Dict[str, np.ndarray]):
         """
-        alpha_i * beta_j * lambda_value, beta_i * alpha_j, 
-        for each match in the dataset
+        collapse the traces to the estimated params and gamma, the means of
+        the draws of every chain
         """
-        # home team index
-        i_s = [teams.index(t) for t in data.HomeTeam]
-        # away team index
-        j_s = [teams.index(t) for t in data.AwayTeam]
-
-        # deterministic, determined by alpha_i, alpha_j, beta_i, beta_j,
-        # lambda_value
-        home_scoring_strength = np.array([alpha[i] for i in i_s]) * \
-                                np.array([beta[j] for j in j_s]) * \
-                                np.array(lambda_value)
-
-        away_scoring_strength = np.array([beta[i] for i in i_s]) * \
-                                np.array([alpha[j] for j in j_s])
-        # params = zip(home_scoring_strength, away_scoring_strength)
-
-        # likelihood
-        home_score = pymc.Poisson('home_score', home_scoring_strength,
-                                  value=data.FTHG, observed=True)
-        away_score = pymc.Poisson('away_score', away_scoring_strength,
-                                  value=data.FTAG, observed=True)
-
-        t_now = data.Date[data.index[-1]] + pd.Timedelta('1 days 00:00:00')
-        t_diff = np.array([item.days for item in (t_now - data.Date)])
-        time_weighting = pymc.exp(-t_diff * 0.01)
-        likelihood = (home_score * away_score) ** time_weighting
-
-        # wrap the model
-        model = pymc.MCMC([likelihood, alpha, beta, lambda_value])
-
-        # run the simulation
-        model.sample(iter=5000, burn=100, thin=10, verbose=False,
-                     progress_bar=True)
-
-        # estimated_params
         estimated_params = pd.DataFrame({
-            'team': teams, 'alpha(attack)': [0.0] * n,
-            'beta(defence)': [0.0] * n},
+            'team': teams,
+            'alpha(attack)': np.round(traces['alpha'].mean(axis=0), 2),
+            'beta(defence)': np.round(traces['beta'].mean(axis=0), 2)},
             columns=['team', 'alpha(attack)', 'beta(defence)'])
 
-        for p in alpha:
-            estimated_params.loc[
-                estimated_params['team'] == p.__doc__.split('(')[0],
-                'alpha(attack)'] = round(model.trace(p.__name__)[:].mean(), 2)
-        for p in beta:
-            estimated_params.loc[
-                estimated_params['team'] == p.__doc__.split('(')[0],
-                'beta(defence)'] = round(model.trace(p.__name__)[:].mean(), 2)
-
-        estimated_gamma = lambda_value
+        estimated_gamma = float(np.mean(traces['lambda_value']))
         logger.info(estimated_params)
 
         return estimated_params, estimated_gamma
 
+    @staticmethod
+    def build_model(data: pd.DataFrame, engine='mcmc',
+                    half_life=DEFAULT_HALF_LIFE, model='poisson'):
+        if engine == 'mle':
+            teams, traces = fit_mle(data, half_life, model=model)
+        else:
+            teams, traces = ScoreProbabilityModel.sample_posterior(
+                data, half_life=half_life, model=model)
+        return ScoreProbabilityModel.estimate_params(teams, traces)
+
     def get_dir_file(self):
+        if self.joint and self.league_id is not None:
+            # the same directory whichever league of the union is predicted
+            names = sorted(
+                SUPPORT_LEAGUE_ID_NAME.get(league_id, str(league_id))
+                for league_id in [self.league_id] + self.other_leagues())
+            return 'output/joint_{0}/'.format('_'.join(names))
         if self.league_id in SUPPORT_LEAGUE_ID_LIST:
             dir_file = 'output/{0}/'.format(SUPPORT_LEAGUE_ID_NAME.get(
                 self.league_id))
@@ -187,39 +655,157 @@ class ScoreProbabilityModel:
         else:
             return None
 
-    def predict(self, team_a_name: str, team_b_name: str) -> pd.DataFrame:
+    def fit(self):
+        """
+        run the sampler once on the current data snapshot, the posterior is
+        reused by every later predict call
+        """
+        if self.estimated_params is not None:
+            return self
+
+        if self.engine == 'mle':
+            # milliseconds, nothing worth caching
+            return self._set_fit(*fit_mle(self.data, self.half_life,
+                                          weights=self.weights,
+                                          model=self.model))
+
+        dir_file = self.get_dir_file()
+        if not self.use_cache or dir_file is None:
+            return self._set_fit(*self.sample_posterior(
+                self.data, half_life=self.half_life, weights=self.weights,
+                model=self.model, **self.sampler_settings))
+
+        cache = PosteriorCache(dir_file)
+        key = cache.fingerprint(self.data, dict(
+            self.sampler_settings, half_life=self.half_life,
+            model=self.model))
+        # the leagues of a joint union share the directory, the first worker
+        # samples and saves, the others wait and load its posterior, a
+        # refit only reuses a posterior saved while it waited
+        requested = time.time()
+        with cache.lock():
+            cached = cache.load(key, since=requested if self.refit else None)
+            if cached is None:
+                # the last posterior of the league is a close start when
+                # only a game week was added since
+                cached = self.sample_posterior(
+                    self.data, half_life=self.half_life,
+                    initial=cache.latest(), weights=self.weights,
+                    model=self.model, **self.sampler_settings)
+                cache.save(key, *cached)
+
+        return self._set_fit(*cached)
+
+    def _set_fit(self, teams: typing.List[str],
+                 traces: typing.Dict[str, np.ndarray]):
+        """keep the traces and the params as vectors indexed by team code"""
+        if 'log_strength' in traces:
+            # attack and defence of every league on the scale of the first
+            leagues, team_league = team_leagues(self.data, teams)
+            alpha, beta = league_scaled(traces, team_league)
+            traces = dict(traces, alpha=alpha, beta=beta)
+            logger.info("league strengths: {0}".format(dict(zip(
+                leagues, np.round(np.exp(np.concatenate([[0.0], np.mean(
+                    traces['log_strength'], axis=0).ravel()])), 2)))))
+        self.teams, self.traces = teams, traces
+        self.team_index = TeamIndex(teams)
+        self.estimated_params, self.estimated_gamma = self.estimate_params(
+            teams, traces)
+        self.attack = self.estimated_params['alpha(attack)'].values
+        self.defence = self.estimated_params['beta(defence)'].values
+        self.home_advantage = self.estimated_gamma
+        self.rho = float(np.mean(traces['rho'])) if 'rho' in traces \
+            else None
+        return self
+
+    def strengths(self, home_teams, away_teams):
+        """
+        scoring strengths of a batch of matches
+        :param home_teams: home team of every match
+        :param away_teams: away team of every match
+        :return: home_strength, away_strength arrays
+        """
+        self.fit()
+        home = self.team_index.codes(home_teams)
+        away = self.team_index.codes(away_teams)
 
-        estimated_params, estimated_gamma = self.build_model(self.data)
+        home_strength = self.attack[home] * self.defence[away] * \
+            self.home_advantage
+        away_strength = self.attack[away] * self.defence[home]
 
-        team_a_attack = estimated_params.loc[
-            estimated_params['team'] == team_a_name, 'alpha(attack)'].values[0]
-        team_a_defence = estimated_params.loc[
-            estimated_params['team'] == team_a_name, 'beta(defence)'].values[0]
-        team_b_attack = estimated_params.loc[
-            estimated_params['team'] == team_b_name, 'alpha(attack)'].values[0]
-        team_b_defence = estimated_params.loc[
-            estimated_params['team'] == team_b_name, 'beta(defence)'].values[0]
+        return home_strength, away_strength
 
-        home_strength = team_a_attack * team_b_defence * (
-            estimated_gamma.value.reshape(1, 1)[0, 0])
-        away_strength = team_b_attack * team_a_defence
+    def posterior_matrices(self, home_teams, away_teams) -> np.ndarray:
+        """
+        posterior predictive score matrices of a batch of matches, the
+        average of the poisson score matrix over thinned posterior draws
+        :return: (n_matches, k, k) array
+        """
+        self.fit()
+        home = self.team_index.codes(home_teams)
+        away = self.team_index.codes(away_teams)
+
+        # evenly thinned draws, at most self.draws of them
+        n_draws = len(self.traces['lambda_value'])
+        idx = np.unique(np.linspace(
+            0, n_draws - 1, min(self.draws, n_draws)).astype(int))
+        alpha, beta = self.traces['alpha'][idx], self.traces['beta'][idx]
+        lambda_value = self.traces['lambda_value'][idx].reshape(-1, 1)
+        rho = None
+        if 'rho' in self.traces:
+            rho = np.repeat(self.traces['rho'][idx], len(home))
+
+        # (draws, n_matches)
+        home_strength = alpha[:, home] * beta[:, away] * lambda_value
+        away_strength = alpha[:, away] * beta[:, home]
+
+        mtr = score_matrices(home_strength.ravel(), away_strength.ravel(),
+                             self.goal_limit, rho)
+        return mtr.reshape(
+            len(idx), len(home), self.goal_limit, self.goal_limit).mean(axis=0)
+
+    def predict_matrices(self, home_teams, away_teams) -> np.ndarray:
+        """score matrices of a batch of matches --> (n_matches, k, k)"""
+        if self.predictive == 'posterior':
+            return self.posterior_matrices(home_teams, away_teams)
+
+        home_strength, away_strength = self.strengths(home_teams, away_teams)
+        return score_matrices(home_strength, away_strength, self.goal_limit,
+                              self.rho)
+
+    def predict_values(self, team_a_name: str,
+                       team_b_name: str) -> np.ndarray:
+        """
+        score matrix of a match
+        :param team_a_name: home team as in the played data --> qtw team id
+            of the database and snapshot sources, team name of a csv
+        :param team_b_name: away team, the same
+        :return: k x k, index --> home team goals, columns --> away goals
+        """
+        self.fit()
+        if self.predictive == 'posterior':
+            return self.posterior_matrices([team_a_name], [team_b_name])[0]
+
+        home, away = self.team_index.code(team_a_name), \
+            self.team_index.code(team_b_name)
+
+        home_strength = self.attack[home] * self.defence[away] * \
+            self.home_advantage
+        away_strength = self.attack[away] * self.defence[home]
 
         logger.info('home_strength = {0}, away_strength = {1}'.format(
             home_strength, away_strength))
 
-        _home_rv, _away_rv = poisson(home_strength), poisson(away_strength)
+        return score_matrix(home_strength, away_strength, self.goal_limit,
+                            self.rho)
 
-        all_outcome = tuple(
-            [tuple((j, i)) for i in range(11) for j in range(11)])
+    def save_matrix(self, team_a_name: str, team_b_name: str,
+                    values: np.ndarray) -> pd.DataFrame:
+        """save the score expectation csv of a match, rounded to 4 dp"""
 
-        goal_limit = range(11)
-        mtr = pd.DataFrame(
-            dict(zip(goal_limit, [np.zeros(11) for _ in range(11)])))
+        # index --> home team goals, columns --> away team goals
+        mtr = pd.DataFrame(np.round(values, 4))
 
-        for i, j in all_outcome:
-            mtr.loc[i, j] = round(_home_rv.pmf(i) * _away_rv.pmf(j), 4)
-
-        # save the score expectation
         dir_file = self.get_dir_file()
 
         if dir_file is not None:
@@ -232,105 +818,181 @@ class ScoreProbabilityModel:
 
         return mtr
 
+    def predict(self, team_a_name: str, team_b_name: str) -> pd.DataFrame:
+
+        values = self.predict_values(team_a_name, team_b_name)
+        return self.save_matrix(team_a_name, team_b_name, values)
+
 
 def total_score_matrix(data: pd.DataFrame) -> typing.Dict[str, float]:
     """
     according to a data frame to get a score matrix
     :param data: data frame
-    :return:
+    :return: legacy "i:j" score dict, run_predict stores encode_score
     """
     result_dict = {}
 
-    result_list = [(i, j) for i in range(11) for j in range(11)]
-    for score_pairs in result_list:
-        result_key = str(score_pairs[0]) + ':' + str(score_pairs[1])
-        prob_value = round(data.ix[score_pairs[0], score_pairs[1]], 4)
-        if prob_value != 0.0:
-            result_dict[result_key] = prob_value
+    values = np.round(np.asarray(data, dtype=float), 4)
+    for i, j in zip(*np.nonzero(values)):
+        result_dict[str(i) + ':' + str(j)] = float(values[i, j])
 
     return result_dict
 
 
-def predict(db_client: MongoClient, qtw_league_id: int, home_name: str,
-            away_name: str) -> pd.DataFrame:
+def league_model(db_client: MongoClient, qtw_league_id: int,
+                 data_source: str = 'database', league_id2=None,
+                 **model_options) -> ScoreProbabilityModel:
     """
     when data_source = 'opta', csv and csv2 do not change
     when data_source = 'csv', csv --> data frame columns:
             Date, HomeTeam, AwayTeam, FTHG, FTAG, status, gameweek
             2016-08-13 11:30:00, Hull City, Leicester City, 2, 1, Played, 1
+    :param data_source: 'database' or 'snapshot'
+    :param league_id2: other leagues of a joint fit
+    :param model_options: keyword options of ScoreProbabilityModel, such as
+        refit, engine, predictive, draws, model, joint
+    :return: model loaded with the played data snapshot of the league, it is
+        fitted on the first predict call and reused for every fixture
     """
 
-    data_source, lang = "database", "cn"
-    league_id, league_id2 = qtw_league_id, None
+    lang = "cn"
+    league_id = qtw_league_id
     csv, csv2 = None, None
 
-    # run calculate
     model = ScoreProbabilityModel(db_client, data_source, league_id,
-                                  league_id2, csv, csv2, lang)
+                                  league_id2, csv, csv2, lang,
+                                  **model_options)
     model.get_data()
 
-    return model.predict(home_name, away_name)
+    return model
+
+
+def predict(db_client: MongoClient, qtw_league_id: int, home_name: str,
+            away_name: str) -> pd.DataFrame:
+    """predict a single match, prefer league_model for a whole slate"""
+
+    model = league_model(db_client, qtw_league_id)
+    en_name_to_team_id = {
+        name: team_id for team_id, name in team_id_en_name_by_league_id(
+            db_client=db_client, league_id=qtw_league_id).items()}
+
+    values = model.predict_values(en_name_to_team_id[home_name],
+                                  en_name_to_team_id[away_name])
+    return model.save_matrix(home_name, away_name, values)
+
+
+def joint_options(qtw_league_id: int, joint_leagues) -> dict:
+    """
+    league_model options of a joint fit of the league with joint_leagues
+    :param joint_leagues: league names, such as ["yc", "xj"] or "yc,xj"
+    :return: {} when no other league is given
+    """
+    if not joint_leagues:
+        return {}
+    if isinstance(joint_leagues, str):
+        joint_leagues = joint_leagues.split(",")
+
+    league_id2 = [int(SUPPORT_LEAGUE_NAME_ID[name]) for name in joint_leagues
+                  if int(SUPPORT_LEAGUE_NAME_ID[name]) != int(qtw_league_id)]
+    if not league_id2:
+        return {}
+    return {'league_id2': league_id2, 'joint': True}
 
 
 def run_predict(db_client: MongoClient, league_name: str,
-                start_time: str, end_time: str):
+                start_time: str, end_time: str, joint_leagues=None,
+                **model_options):
     """
     produce match score prob
+    :param joint_leagues: leagues fitted jointly with the league, such as
+        ["yc", "xj"], the fixtures of every league of the union are priced,
+        the matches between their teams included, the joint posterior is
+        cached once for every league of the union
+    :param model_options: keyword options of league_model, such as
+        data_source, refit, engine, predictive, draws
     :return: csv file
     """
 
     model_tb = db_client['xscore']["model_gauss"]
     league_id = int(SUPPORT_LEAGUE_NAME_ID[league_name])
-    team_id_to_en_name = team_id_en_name_by_league_id(
-        db_client=db_client, league_id=league_id)
-
-    fixture_data = get_fixture_data(db_client, league_id, start_time, end_time)
+    joint = joint_options(league_id, joint_leagues)
+
+    # team ids are unique across leagues, so the names of the union merge
+    team_id_to_en_name = dict()
+    fixture_lst = []
+    for union_id in [league_id] + joint.get('league_id2', []):
+        team_id_to_en_name.update(team_id_en_name_by_league_id(
+            db_client=db_client, league_id=union_id))
+        fixture = get_fixture_data(db_client, union_id, start_time, end_time)
+        fixture['league_id'] = union_id
+        fixture_lst.append(fixture)
+    fixture_data = pd.concat(fixture_lst, ignore_index=True)
     if fixture_data.empty:
         logger.error("There is no match in {0} during {1} and {2} !!!".format(
             league_name, start_time, end_time))
         return None
 
-    total_qtw_match_id = fixture_data.qtw_match_id.unique()
+    fixture_data = fixture_data.drop_duplicates('qtw_match_id')
+    finished = set(result['qtw_match_id'] for result in model_tb.find(
+        filter={'qtw_match_id': {'$in': [
+            int(match_id) for match_id in fixture_data.qtw_match_id]}},
+        projection={'_id': 0, 'qtw_match_id': 1}))
+    for match_id in sorted(finished):
+        logger.info("qtw_match_id = {0} have finished!".format(match_id))
+    fixture_data = fixture_data[~fixture_data.qtw_match_id.isin(finished)]
+    if fixture_data.empty:
+        return None
 
-    for match_id in total_qtw_match_id:
-        result = model_tb.find_one(filter={'qtw_match_id': int(match_id)},
-                                   projection={'qtw_match_id': 1})
-        if result is not None:
-            logger.info("qtw_match_id = {0} have finished!".format(match_id))
-        else:
-            try:
-                result_dict = dict()
-                result_dict['qtw_match_id'] = int(match_id)
-                match_data = fixture_data[
-                    fixture_data['qtw_match_id'] == match_id]
-                match_data = match_data.reset_index(drop=True)
-                result_dict['match_time'] = match_data.ix[0, ['match_time']][
-                    'match_time']
-                result_dict['home_id'] = int(match_data.ix[0, ['home_id']][
-                                                 'home_id'])
-                result_dict['away_id'] = int(match_data.ix[0, ['away_id']][
-                                                 'away_id'])
-
-                # start calculate gauss model
-                result = predict(
-                    db_client=db_client,
-                    qtw_league_id=league_id,
-                    home_name=team_id_to_en_name[result_dict["home_id"]],
-                    away_name=team_id_to_en_name[result_dict['away_id']])
-
-                score_dict = total_score_matrix(result)
-                result_dict["league_id"] = league_id
-                result_dict["score"] = score_dict
-
-                # save date to mongodb
-                logging.info("result_dict = {0}".format(result_dict))
-                model_tb.insert_one(result_dict)
-
-            except Exception as e:
-                logger.exception(e)
-                logger.error("qtw_match_id = {0} failure".format(match_id))
+    # one data snapshot and one fit for the whole slate, a failed fit is
+    # not retried match by match
+    try:
+        model = league_model(db_client, league_id,
+                             **dict(model_options, **joint))
+        model.fit()
+    except Exception as e:
+        logger.exception(e)
+        logger.error("{0} fit failure, {1} matches skipped".format(
+            league_name, len(fixture_data)))
+        return None
+
+    for _, match in fixture_data.iterrows():
+        match_id = int(match['qtw_match_id'])
+        try:
+            result_dict = dict()
+            result_dict['qtw_match_id'] = match_id
+            result_dict['match_time'] = match['match_time']
+            result_dict['home_id'] = int(match['home_id'])
+            result_dict['away_id'] = int(match['away_id'])
+
+            unknown = [team_id for team_id in (result_dict["home_id"],
+                                               result_dict["away_id"])
+                       if team_id not in model.team_index.teams]
+            if unknown:
+                # such as a cup match against a club outside the union
+                logger.warning("qtw_match_id = {0} skipped, teams {1} are "
+                               "not in the fit of {2}".format(
+                                   match_id, unknown, league_name))
                 continue
 
+            # the model is fitted on team ids, names only name the csv
+            values = model.predict_values(result_dict["home_id"],
+                                          result_dict["away_id"])
+            model.save_matrix(
+                team_id_to_en_name.get(result_dict["home_id"]),
+                team_id_to_en_name.get(result_dict["away_id"]), values)
+
+            result_dict["league_id"] = int(match['league_id'])
+            result_dict.update(encode_score(values))
+
+            # save date to mongodb
+            logging.info("result_dict = {0}".format(result_dict))
+            model_tb.insert_one(result_dict)
+
+        except Exception as e:
+            logger.exception(e)
+            logger.error("qtw_match_id = {0} failure".format(match_id))
+            continue
+
 
 if __name__ == "__main__":
     from base import connect_mongodb
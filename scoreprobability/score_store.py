@@ -0,0 +1,127 @@
+"""
+@Project   : ScoreProbability
+@Module    : score_store.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 5:45 PM
+@Desc      : dense storage of the model_gauss score matrices, a float32 k x k
+             array as bson binary, and the migration of the "i:j" score dicts
+"""
+
+import typing
+
+import fire
+import loguru
+import numpy as np
+from bson.binary import Binary
+from pymongo import MongoClient, UpdateOne
+
+from base import connect_mongodb
+from market import GOAL_LIMIT, score_grid
+
+logger = loguru.logger
+
+SCORE_VERSION = 1
+SCORE_DTYPE = '<f4'
+
+# fields of a model_gauss doc read by decode_score, both formats
+SCORE_FIELDS = ['score_bin', 'score_shape', 'score_version', 'score']
+
+
+def encode_score(values: np.ndarray) -> typing.Dict[str, object]:
+    """
+    model_gauss fields of a score matrix
+    :param values: k x k, index --> home team goals, columns --> away goals
+    :return: score_bin, score_shape, score_version
+    """
+    values = np.ascontiguousarray(values, dtype=SCORE_DTYPE)
+    return {
+        "score_bin": Binary(values.tobytes()),
+        "score_shape": list(values.shape),
+        "score_version": SCORE_VERSION
+    }
+
+
+def decode_score(doc: dict, goal_limit: int = None) -> np.ndarray:
+    """
+    score matrix of a model_gauss doc
+    :param doc: doc with the score_bin fields or the legacy "i:j" score dict
+    :param goal_limit: size of the returned grid, the stored matrix is cut or
+        padded with zeros, None --> stored size
+    :return: k x k float array
+    """
+    if doc.get("score_bin") is not None:
+        if doc.get("score_version", SCORE_VERSION) != SCORE_VERSION:
+            raise ValueError("unknown score_version {0}".format(
+                doc["score_version"]))
+        values = np.frombuffer(bytes(doc["score_bin"]), dtype=SCORE_DTYPE)
+        values = values.reshape(doc["score_shape"]).astype(float)
+    elif doc.get("score") is not None:
+        # legacy "i:j" dict, zero cells are not stored
+        size = max([int(value) + 1 for score_pair in doc["score"]
+                    for value in score_pair.split(":")] or [0])
+        return score_grid(doc["score"], goal_limit or max(size, GOAL_LIMIT))
+    else:
+        raise KeyError("doc has no score")
+
+    if goal_limit is None or values.shape == (goal_limit, goal_limit):
+        return values
+    return score_grid(values, goal_limit)
+
+
+def migrate_scores(db_client: MongoClient, batch_size: int = 500,
+                   drop_legacy: bool = False) -> int:
+    """
+    add the score_bin fields to the model_gauss docs of the "i:j" format
+    :param db_client: mongodb client
+    :param batch_size: docs per bulk write
+    :param drop_legacy: also unset the score dict
+    :return: number of migrated docs
+    """
+    tb = db_client["xscore"]["model_gauss"]
+    doc_filter = {"score": {"$exists": True}}
+    if not drop_legacy:
+        doc_filter["score_bin"] = {"$exists": False}
+    # docs converted by an earlier run without drop_legacy still carry the
+    # score dict, they are only unset
+    cursor = tb.find(filter=doc_filter,
+                     projection={"_id": 1, "score": 1, "score_bin": 1})
+
+    migrated, operations = 0, []
+    for doc in cursor:
+        update = {}
+        if doc.get("score_bin") is None:
+            update["$set"] = encode_score(decode_score(doc))
+        if drop_legacy:
+            update["$unset"] = {"score": ""}
+        operations.append(UpdateOne({"_id": doc["_id"]}, update))
+
+        if len(operations) >= batch_size:
+            tb.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+            logger.info("{0} model_gauss docs migrated".format(migrated))
+
+    if operations:
+        tb.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+
+    logger.info("model_gauss migration finished, {0} docs".format(migrated))
+    return migrated
+
+
+def main(batch_size: int = 500, drop_legacy: bool = False):
+    """
+    migrate the model_gauss score dicts to dense arrays
+    :param batch_size: docs per bulk write
+    :param drop_legacy: also remove the "i:j" score dicts
+    """
+    db_client = connect_mongodb()
+    try:
+        migrate_scores(db_client, batch_size, drop_legacy)
+    finally:
+        db_client.close()
+
+
+if __name__ == "__main__":
+    # python3 score_store.py --drop_legacy
+    fire.Fire(main)
@@ -0,0 +1,197 @@
+"""
+@Project   : ScoreProbability
+@Module    : snapshot.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 7:05 PM
+@Desc      : per league feather snapshot of the played data, refreshed
+             incrementally from mongodb and read without a database
+"""
+
+import os
+
+import fire
+import loguru
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+
+from base import SUPPORT_LEAGUE_NAME_ID, connect_mongodb, cursor_columns
+
+logger = loguru.logger
+
+SNAPSHOT_DIR = "output/snapshot/"
+
+# played matches of the last days of a snapshot are read again on every
+# refresh, corrected scores and statuses of that window reach the snapshot
+REREAD_DAYS = 30
+
+SNAPSHOT_COLUMNS = ['qtw_match_id', 'Date', 'HomeTeam', 'AwayTeam', 'FTHG',
+                    'FTAG', 'status', 'gameweek']
+
+# HomeTeam / AwayTeam --> qtw team ids, mapped to names at display
+SNAPSHOT_DTYPES = {
+    'qtw_match_id': np.int64, 'HomeTeam': np.int64, 'AwayTeam': np.int64,
+    'FTHG': np.int8, 'FTAG': np.int8,
+    'status': np.int8, 'gameweek': np.int16
+}
+
+
+def _feather():
+    """pyarrow feather module, pyarrow is only needed by the snapshots"""
+    try:
+        from pyarrow import feather
+    except ImportError:
+        raise ImportError(
+            "data_source='snapshot' needs pyarrow: "
+            "pip install 'pyarrow>=0.17.0'")
+    return feather
+
+
+def snapshot_path(qtw_league_id: int,
+                  snapshot_dir: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(snapshot_dir, "{0}.feather".format(int(qtw_league_id)))
+
+
+def typed_played_data(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    played data with the snapshot column types, sorted by date
+    Date --> datetime64, HomeTeam / AwayTeam --> team ids, goals --> int8
+    """
+    data = data[SNAPSHOT_COLUMNS].copy()
+    data['Date'] = pd.to_datetime(data['Date'])
+    for column, dtype in SNAPSHOT_DTYPES.items():
+        data[column] = data[column].astype(dtype)
+    return data.sort_values(['Date', 'qtw_match_id']).reset_index(drop=True)
+
+
+def fetch_played_rows(db_client: MongoClient, qtw_league_id: int,
+                      since: str = None) -> pd.DataFrame:
+    """
+    played matches of the league from match_time since on
+    :param since: such as "2018-08-01 00:00:00", None --> every match
+    :return: data frame of SNAPSHOT_COLUMNS
+    """
+    # a range on the last key of the league_status_match_time index
+    query = {"qtw_league_id": int(qtw_league_id), "status": 2}
+    if since is not None:
+        query["match_time"] = {"$gte": since}
+
+    result = db_client["xscore"]["match_info"].find(
+        filter=query,
+        projection={
+            "_id": 0, "qtw_match_id": 1, "home_id": 1, "away_id": 1,
+            "match_time": 1, "home_score": 1, "away_score": 1, "status": 1,
+            "game_week": 1
+        }
+    )
+
+    columns = cursor_columns(result, {
+        "qtw_match_id": np.int64, "match_time": object,
+        "home_id": np.int64, "away_id": np.int64, "home_score": np.int64,
+        "away_score": np.int64, "status": np.int64, "game_week": np.int64
+    })
+
+    return pd.DataFrame({
+        'qtw_match_id': columns["qtw_match_id"],
+        'Date': columns["match_time"],
+        'HomeTeam': columns["home_id"], 'AwayTeam': columns["away_id"],
+        'FTHG': columns["home_score"], 'FTAG': columns["away_score"],
+        'status': columns["status"], 'gameweek': columns["game_week"]
+    }, columns=SNAPSHOT_COLUMNS)
+
+
+def load_snapshot(qtw_league_id: int,
+                  snapshot_dir: str = SNAPSHOT_DIR) -> pd.DataFrame:
+    """
+    played data of the league from its snapshot, memory mapped
+    :return: data frame --> qtw_match_id, Date, HomeTeam, AwayTeam, FTHG,
+        FTAG, status, gameweek
+    """
+    path = snapshot_path(qtw_league_id, snapshot_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            "no snapshot of league {0}, refresh it from mongodb first".format(
+                qtw_league_id))
+    table = _feather().read_table(path, memory_map=True)
+    return table.to_pandas()
+
+
+def refresh_snapshot(db_client: MongoClient, qtw_league_id: int,
+                     snapshot_dir: str = SNAPSHOT_DIR,
+                     reread_days: float = REREAD_DAYS,
+                     full: bool = False) -> pd.DataFrame:
+    """
+    bring the snapshot of the league up to date, the played matches from
+    reread_days before its latest match on replace the snapshot rows of
+    that window by qtw_match_id, older rows are kept as they are
+    :param reread_days: trailing window read again from mongodb
+    :param full: rebuild the snapshot from every played match
+    :return: refreshed played data
+    """
+    feather = _feather()
+    path = snapshot_path(qtw_league_id, snapshot_dir)
+
+    if os.path.exists(path) and not full:
+        data = load_snapshot(qtw_league_id, snapshot_dir)
+    else:
+        data = None
+
+    if data is None or data.empty:
+        kept, since = None, None
+    else:
+        start = data['Date'].max() - pd.Timedelta(days=float(reread_days))
+        since = start.strftime("%Y-%m-%d %H:%M:%S")
+        kept = data[(data['Date'] < start).values]
+
+    window = fetch_played_rows(db_client, qtw_league_id, since)
+    logger.info("league {0} snapshot: {1} played matches since {2}".format(
+        qtw_league_id, len(window), since))
+
+    if kept is not None:
+        # a match read again replaces its kept row
+        kept = kept[~kept['qtw_match_id'].isin(window['qtw_match_id'])]
+        window = pd.concat([kept, window], ignore_index=True)
+    refreshed = typed_played_data(window)
+
+    if data is not None and refreshed.equals(data):
+        return data
+    data = refreshed
+
+    if not os.path.exists(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    tmp_path = path + ".tmp"
+    feather.write_feather(data, tmp_path)
+    os.replace(tmp_path, path)
+
+    return data
+
+
+def main(league_name: str = "all", snapshot_dir: str = SNAPSHOT_DIR,
+         full: bool = False):
+    """
+    refresh the played data snapshots from mongodb
+    :param league_name: "all" or a league such as "dj", "yc"
+    :param snapshot_dir: directory of the snapshots
+    :param full: rebuild the snapshots from every played match, corrections
+        older than REREAD_DAYS only reach a snapshot this way
+    """
+    if league_name == "all":
+        league_name_lst = list(SUPPORT_LEAGUE_NAME_ID.keys())
+    else:
+        league_name_lst = [league_name]
+
+    db_client = connect_mongodb()
+    try:
+        for name in league_name_lst:
+            data = refresh_snapshot(
+                db_client, int(SUPPORT_LEAGUE_NAME_ID[name]), snapshot_dir,
+                full=full)
+            logger.info("{0} snapshot: {1} played matches".format(
+                name, len(data)))
+    finally:
+        db_client.close()
+
+
+if __name__ == "__main__":
+    # python3 snapshot.py --league_name all
+    fire.Fire(main)
@@ -0,0 +1,153 @@
+"""
+@Project   : ScoreProbability
+@Module    : transport.py
+@Author    : HjwGivenLyy [1752929469@qq.com]
+@Created   : 10/18/26 4:05 PM
+@Desc      : http transport of the crawler with record / replay of the
+             responses, replay runs the pipeline offline from the archive
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import typing
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import loguru
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = loguru.logger
+
+# "live": network only, "record": network and archive the responses,
+# "replay": archive only
+TRANSPORT_MODE_LST = ['live', 'record', 'replay']
+
+DEFAULT_ARCHIVE_DIR = "fixtures/"
+
+# query values which change between runs without changing the page
+VOLATILE_QUERY_KEYS = ['version']
+
+# conditional headers are not recorded, the archive keeps full bodies
+CONDITIONAL_HEADERS = ['If-None-Match', 'If-Modified-Since']
+
+
+class ReplayMissError(LookupError):
+    pass
+
+
+class RecordedResponse:
+    def __init__(self, url: str, status_code: int, headers: dict,
+                 content: bytes, encoding: str = None):
+        """archived response with the attributes the crawler reads"""
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class HttpTransport:
+    def __init__(self, mode: str = 'live',
+                 archive_dir: str = DEFAULT_ARCHIVE_DIR):
+        """
+        Initialization parameters
+        :param mode: "live", "record" or "replay"
+        :param archive_dir: directory of the recorded responses
+        """
+        if mode not in TRANSPORT_MODE_LST:
+            raise ValueError(
+                "transport mode must be in {0}".format(TRANSPORT_MODE_LST))
+        self.mode = mode
+        self.archive_dir = archive_dir
+
+    @staticmethod
+    def key(url: str) -> str:
+        """archive key of a url, volatile query values are dropped"""
+        parts = urlparse(url)
+        query = [(k, v) for k, v in parse_qsl(parts.query)
+                 if k not in VOLATILE_QUERY_KEYS]
+        stable_url = urlunparse(parts._replace(query=urlencode(sorted(query))))
+        return hashlib.sha1(stable_url.encode("utf-8")).hexdigest()
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.archive_dir, urlparse(url).netloc,
+                            "{0}.json.gz".format(self.key(url)))
+
+    def load(self, url: str) -> RecordedResponse:
+        path = self.path(url)
+        if not os.path.exists(path):
+            raise ReplayMissError("no recorded response of {0}".format(url))
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            record = json.load(f)
+        return RecordedResponse(
+            record["url"], record["status_code"], record["headers"],
+            base64.b64decode(record["content"]), record["encoding"])
+
+    def save(self, url: str, response):
+        path = self.path(url)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        record = {
+            "url": url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "encoding": response.encoding,
+            "content": base64.b64encode(response.content).decode("ascii")
+        }
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def get(self, url: str, headers: dict = None,
+            session: requests.Session = None, timeout: float = None):
+        """
+        http get through the transport
+        :param url: url
+        :param headers: request headers
+        :param session: session of the live request, None --> requests.get
+        :param timeout: seconds of the live request
+        :return: requests.Response or RecordedResponse
+        """
+        if self.mode == 'replay':
+            return self.load(url)
+
+        if self.mode == 'record' and headers:
+            headers = {k: v for k, v in headers.items()
+                       if k not in CONDITIONAL_HEADERS}
+
+        requester = session if session is not None else requests
+        response = requester.get(url, headers=headers, timeout=timeout)
+
+        if self.mode == 'record':
+            self.save(url, response)
+
+        return response
+
+
+_TRANSPORT = HttpTransport()
+
+
+def get_transport() -> HttpTransport:
+    return _TRANSPORT
+
+
+def set_transport(mode: str = 'live',
+                  archive_dir: str = DEFAULT_ARCHIVE_DIR) -> HttpTransport:
+    """switch the transport of this process"""
+    global _TRANSPORT
+    _TRANSPORT = HttpTransport(mode, archive_dir)
+    logger.info("http transport: {0} {1}".format(mode, archive_dir))
+    return _TRANSPORT
+
+
+def transport_options() -> typing.Dict[str, str]:
+    """options to rebuild the current transport in another process"""
+    return {'mode': _TRANSPORT.mode, 'archive_dir': _TRANSPORT.archive_dir}